@@ -1,16 +1,24 @@
 # -*- coding: utf-8 -*-
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, colorchooser
-from PIL import Image, ImageEnhance, ImageTk, ImageDraw, ImageFont, ImageOps, ImageColor
-import numpy as np
-import random
-import math
-import tkinter.font as tkFont
-
-ASCII_BASIC = "@#MWNQBGFHKEPSAOZXafeowgp][}{?>=<+_;:~-,."
-ASCII_BOX = "█▉▊▋▌▍▎▏▓▒░▐▕▖▗▘▙▚▛▜▝▞▟■□▢▣▤▥▦▧▨▩▪▫▬▭▮▯"  # Block characters
-ASCII_CCC = "中日人木水火山石田土手口目耳足車金玉貝魚鳥犬花草竹空雨電気上下左右中大小出入本文字" 
+from tkinter import ttk, filedialog, messagebox, colorchooser, simpledialog
+from PIL import Image, ImageTk, ImageOps
+import os
+import threading
+import asci_anim
+import asci_cache
+import asci_engine
+import asci_frames
+import asci_layout
+import asci_ramp
+import asci_shape
+import asci_raster
+import asci_render
+import asci_shm
+import asci_view
+from asci_engine import ASCII_BASIC, ASCII_BOX, ASCII_CCC
+
 CURSOR = "trek"  # Try 'spider', 'pirate', or 'trek' on Linux
+SETTLE_MS = 1000  # a render shown this long without a newer one is written to the preview cache
 
 class ASCIGEN:
     def __init__(self, root):
@@ -36,8 +44,25 @@ class ASCIGEN:
         self.text_color = "#00ff00"
         self.highlight_color = "#00ff00"  # Default highlight color
         self.black_and_white = False
-        self.original_image = None
+        self.original_image = None  # full resolution, decoded only for exports
+        self.working_image = None   # downscaled proxy used by all interactive effects
+        self.source_path = None
+        self.source_size = None
+        self.source_digest = None         # content hash of the source file, for the render cache
+        self.resize_job_id = None
         self.processed_image = None
+        self.pipeline = asci_engine.EffectPipeline()
+        self.render_cache = asci_cache.RenderCache()  # on disk, shared with asci_batch
+        self.preview_cache = asci_cache.RenderCache(asci_cache.PREVIEW_CACHE_DIR,
+                                                    asci_cache.PREVIEW_CACHE_BYTES)
+        self.disk_image = (None, None)    # render-thread memo: (key, image) last read from disk
+        self.settle_job = None
+        self.preview_source = None        # render-thread memo of the fitted preview
+        self.pyramid = None               # ImagePyramid of the shown processed image
+        self.render_pyramid = None        # render-thread memo of the same
+        self.preview_configured = None    # preview frame size at the last <Configure>
+        self.preview_size = None
+        self.preview_frame_image = None
         self.preview_image = None
         
         # Basic effect multipliers
@@ -52,6 +77,13 @@ class ASCIGEN:
         
         # Experimental effect variables
         self.invert_ascii = tk.BooleanVar(value=False)
+        self.float32_pipeline = tk.BooleanVar(value=False)  # fused float32 effect chain
+        self.calibrate_ramp = tk.BooleanVar(value=False)    # map by measured glyph coverage
+        self.shape_match = tk.BooleanVar(value=False)       # pick glyphs by sub-cell shape
+        self.fresh_static = tk.BooleanVar(value=False)      # new STATIC pattern every render
+        self.color_mode = tk.BooleanVar(value=False)        # per-character source colors
+        self.noise_frame = 0                                # current noise bank frame
+        self.font_warnings = set()                          # (feature, charset) pairs already reported
         self.wave_text = tk.DoubleVar(value=0)            # 0 to 20
         self.scramble_rows = tk.BooleanVar(value=False)
         self.rand_char_flip = tk.DoubleVar(value=0)         # 0 to 100
@@ -59,6 +91,10 @@ class ASCIGEN:
         self.brightness_pulse = tk.BooleanVar(value=False)  # (stub)
         self.noise_ripple = tk.DoubleVar(value=0)           # 0 to 50
         self.highlight_effect = tk.DoubleVar(value=0)       # 0 to 100
+        self.glitch_seed = 0  # same seed + same settings = identical glitch output
+        self.gif_frames = 10     # glitch GIF export
+        self.gif_duration = 100  # ms per frame
+        self.chaos_ring = asci_render.FrameRing(range(-50, 55, 5))  # RANDOM FLIP levels
 
         self.ascii_chars = ASCII_BASIC
                 
@@ -66,6 +102,11 @@ class ASCIGEN:
         self.setup_menu()
         self.setup_ui()
 
+        # Effects, preview scaling and ASCII mapping run off the Tk thread
+        self.renderer = asci_render.RenderScheduler(
+            self.root, self.render_frame, self.apply_render,
+            on_error=lambda e: self.show_error("RENDER ERROR", str(e)))
+
     def setup_y2k_style(self):
         self.root.configure(bg='#000000')
         self.root.option_add('*TCombobox*Listbox.font', 'Terminal 10')
@@ -108,6 +149,9 @@ class ASCIGEN:
         file_menu.add_command(label="Export to PNG", command=self.export_to_png)
         file_menu.add_command(label="Export to JPG", command=self.export_to_jpg)
         file_menu.add_command(label="Export to GIF", command=self.export_to_gif)
+        file_menu.add_command(label="Export Animation", command=self.export_animation)
+        file_menu.add_command(label="Export ASCA", command=self.export_to_asca)
+        file_menu.add_command(label="Render Stats", command=self.show_render_stats)
         file_menu.add_command(label="About", command=self.about_section)
         menubar.add_cascade(label="File", menu=file_menu)
         self.root.config(menu=menubar)
@@ -149,6 +193,10 @@ class ASCIGEN:
                                 spacing1=self.line_spacing,
                                 spacing3=self.line_spacing)
         self.ascii_text.grid(row=0, column=0, sticky="nsew")
+        self.layout = asci_layout.TextLayout(self.ascii_text, 'Courier New', 12)
+        self.ascii_text.bind("<Configure>", self.on_output_resize)
+        self.ascii_view = asci_view.TextGridView(self.ascii_text, palette=asci_engine.color_palette())
+        self.ascii_view.set_highlight_colors(self.text_color, self.bg_color)
 
     def setup_preview(self, parent):
         self.preview_frame = ttk.Frame(parent)
@@ -172,8 +220,25 @@ class ASCIGEN:
             
             self.preview_frame.config(width=self.preview_width,
                                     height=self.preview_height)
+
+        # <Configure> also fires for moves and re-grids; only a new size needs a redraw
+        if (event.width, event.height) == self.preview_configured:
+            return
+        self.preview_configured = (event.width, event.height)
         self.show_preview()
 
+    def on_output_resize(self, event):
+        self.layout.on_configure(event)
+        # Debounce window resizes the same way as letter size changes
+        if self.resize_job_id is not None:
+            self.root.after_cancel(self.resize_job_id)
+        self.resize_job_id = self.root.after(150, self._apply_output_resize)
+
+    def _apply_output_resize(self):
+        self.resize_job_id = None
+        self.update_proxy()
+        self.generate_ascii()
+
     def setup_effect_controls(self, parent):
         # Create notebook for tabs
         notebook = ttk.Notebook(parent)
@@ -196,7 +261,7 @@ class ASCIGEN:
         # Character Selection
         ttk.Label(tab_a, text="CHAR SELECT:", font=('OCR A Extended', 9))\
             .grid(row=row_a, column=0, sticky="w", pady=(10,2), padx=10)
-        self.char_set = ttk.Combobox(tab_a, values=["Basic", "Box", "CCC"], 
+        self.char_set = ttk.Combobox(tab_a, values=["Basic", "Box", "CCC", "Custom"], 
                                 font=('OCR A Extended', 9), state="readonly")
         self.char_set.current(0)
         self.char_set.grid(row=row_a, column=1, sticky="ew", pady=(10,2), padx=(0,10))
@@ -258,6 +323,16 @@ class ASCIGEN:
         
         add_checkbox(tab_a, "Invert ASCII", self.invert_ascii, self.generate_ascii, row_a)
         row_a += 1
+        add_checkbox(tab_a, "Float32 Pipeline", self.float32_pipeline, self.generate_ascii, row_a)
+        row_a += 1
+        add_checkbox(tab_a, "Calibrate Ramp", self.calibrate_ramp, self.generate_ascii, row_a)
+        row_a += 1
+        add_checkbox(tab_a, "Shape Match", self.shape_match, self.toggle_shape_match, row_a)
+        row_a += 1
+        add_checkbox(tab_a, "Fresh Static", self.fresh_static, self.generate_ascii, row_a)
+        row_a += 1
+        add_checkbox(tab_a, "Color Mode", self.color_mode, self.generate_ascii, row_a)
+        row_a += 1
 
         # Tab B - Glitch Effects (mirroring Tab A structure)
         row_b = 0
@@ -335,9 +410,49 @@ class ASCIGEN:
             self.chaos_direction = -1
         new_value = current + self.chaos_direction * 5
         self.rand_char_flip.set(new_value)
-        self.generate_ascii()
+        self.show_chaos_frame(new_value)
         self.root.after(100, self.animate_chaos)
 
+    def show_chaos_frame(self, level):
+        # Swap in the pre-rendered frame for this flip level; until the ring
+        # buffer is filled (or after image/charset/grid changes) render normally
+        grid = self.grid_size()
+        if self.processed_image is None or grid is None:
+            return
+        params = self.text_effect_params()
+        del params["rand_char_flip"]
+        key = (self.ascii_chars, self.invert_ascii.get(),
+               (self.calibrate_ramp.get(), self.shape_match.get(), self.color_mode.get()), grid,
+               tuple(sorted(params.items())))
+        self.chaos_ring.prepare(self.processed_image, key,
+                                self.chaos_frame_builder(self.processed_image, key, self.pyramid,
+                                                         self.mapping_params()))
+
+        frame = self.chaos_ring.get(level)
+        if frame is None:
+            self.generate_ascii()
+            return
+        frame_grid, marks, colors = frame
+        self.ascii_view.update(asci_engine.grid_to_lines(frame_grid, self.ascii_chars), colors, marks)
+
+    def chaos_frame_builder(self, processed, key, pyramid=None, mapping=None):
+        # Returns build(level) for the ring thread; the base grid is mapped once,
+        # on that thread, when the first frame is built
+        ascii_chars, invert, (_, _, color), (num_cols, num_rows), params = key
+        base = []
+
+        def build(level):
+            if not base:
+                base.append(asci_engine.map_grid(processed, num_cols, num_rows, ascii_chars, invert,
+                                                 pyramid, **(mapping or {})))
+                base.append(asci_engine.cell_colors(processed, num_cols, num_rows, pyramid=pyramid)
+                            if color else None)
+            frame_grid, marks, source = asci_engine.apply_glitch_effects(
+                base[0], len(ascii_chars), rand_char_flip=max(level, 0), **dict(params))
+            colors = None if base[1] is None else asci_engine.follow_cells(base[1], source)
+            return frame_grid, marks, colors
+        return build
+
     def create_effect_scale(self, parent, label, from_, to, row, start_value=0):
         frame = ttk.Frame(parent)
         frame.grid(row=row, column=0, sticky="ew", pady=(5,5), padx=10)
@@ -369,9 +484,51 @@ class ASCIGEN:
             self.ascii_chars = ASCII_BOX
         elif choice == "CCC":
             self.ascii_chars = ASCII_CCC
+        elif choice == "Custom":
+            chars = simpledialog.askstring("CUSTOM CHARSET", "Characters, densest first:",
+                                           initialvalue=self.ascii_chars, parent=self.root)
+            if chars is None:
+                return
+            try:
+                self.ascii_chars = asci_ramp.custom_charset(chars)
+            except ValueError as e:
+                self.show_error("CHARSET ERROR", str(e))
+                return
             
         self.generate_ascii()
 
+    def charset_lut(self):
+        # Calibrated luminance -> glyph table for the current charset and letter
+        # size (measured once, then read from the on-disk cache), or None for
+        # the linear mapping
+        if not self.calibrate_ramp.get():
+            return None
+        ramp = asci_ramp.calibrate(self.ascii_chars, size=self.layout.metrics()[0])
+        self.warn_missing_glyphs("CALIBRATE RAMP", ramp.missing, "THE STOCK RAMP ORDER")
+        return ramp.lut_for(self.invert_ascii.get())
+
+    def warn_missing_glyphs(self, feature, missing, fallback):
+        # Once per feature and charset: the export font lacks some of its glyphs
+        if not missing or (feature, self.ascii_chars) in self.font_warnings:
+            return
+        self.font_warnings.add((feature, self.ascii_chars))
+        self.show_warning("MISSING GLYPHS",
+                          f"THE EXPORT FONT CANNOT DRAW {len(missing)} OF THESE CHARACTERS "
+                          f"({missing[:20]}).\n{feature} USES {fallback} INSTEAD.")
+
+    def mapping_params(self):
+        # How cells become glyphs, as asci_engine.map_grid/convert keyword arguments
+        features = asci_shape.glyph_features(self.ascii_chars) if self.shape_match.get() else None
+        if features is not None and features.missing:
+            self.warn_missing_glyphs("SHAPE MATCH", features.missing, "BRIGHTNESS MAPPING")
+            features = None
+        return {"lut": self.charset_lut(), "glyph_features": features}
+
+    def toggle_shape_match(self):
+        # Shape matching samples SUBCELL points per cell, so the proxy may need to grow
+        self.update_proxy()
+        self.generate_ascii()
+
 
     def adjust_font_size(self, event=None):
    
@@ -387,22 +544,16 @@ class ASCIGEN:
             # Calculate new font size (75% of slider value)
             new_size = int(float(self.letter_size.get()) * 0.75)
             
-            # Get current font settings
-            current_font = tkFont.Font(font=self.ascii_text.cget("font"))
-            current_size = current_font.actual()["size"]
-            
             # Only update if size changed
-            if new_size != current_size:
-                self.ascii_text.configure(font=('Courier New', int(new_size)))
+            if self.layout.set_font('Courier New', new_size):
+                self.update_proxy()
                 self.generate_ascii()
         finally:
             self.font_job_id = None  # Reset job tracker  
 
     def toggle_black_and_white(self):
         self.black_and_white = self.bw_var.get()
-        if self.original_image:
-            self.process_image()
-            self.show_preview()
+        if self.working_image:
             self.generate_ascii()
 
     def choose_text_color(self):
@@ -410,6 +561,7 @@ class ASCIGEN:
         if color[1]:
             self.text_color = color[1]
             self.ascii_text.configure(fg=self.text_color)
+            self.ascii_view.set_highlight_colors(self.text_color, self.bg_color)
             self.generate_ascii()
 
     def choose_background_color(self):
@@ -417,22 +569,13 @@ class ASCIGEN:
         if color[1]:
             self.bg_color = color[1]
             self.ascii_text.configure(bg=self.bg_color)
+            self.ascii_view.set_highlight_colors(self.text_color, self.bg_color)
             self.generate_ascii()
             
     def update_effect(self, effect_type, value):
-        if effect_type == "brightness":
-            self.brightness = 1 + (value / 50.0)
-        elif effect_type == "contrast":
-            self.contrast = 1 + (value / 50.0)
-        elif effect_type == "exposure":
-            self.exposure = 1 + (value / 50.0)
-        elif effect_type == "glitch":
-            self.distortion = value / 50.0
-        elif effect_type == "static":
-            self.noise = abs(value) / 50.0
-        if self.original_image:
-            self.process_image()
-            self.show_preview()
+        name, factor = asci_engine.slider_value(effect_type, value)
+        setattr(self, name, factor)
+        if self.working_image:
             self.generate_ascii()
 
     def load_image(self):
@@ -441,192 +584,285 @@ class ASCIGEN:
         ])
         if path:
             try:
-                self.original_image = Image.open(path).convert("RGB")
-                self.process_image()
-                self.show_preview()
+                with Image.open(path) as img:
+                    self.source_size = img.size
+                self.source_digest = asci_cache.file_digest(path)
+                self.source_path = path
+                self.original_image = None
+                self.working_image = None
+                self.update_proxy()
                 self.generate_ascii()
             except Exception as e:
                 self.show_error("LOAD ERROR", f"FAILED TO ACCESS:\n{str(e)}")
 
-    def process_image(self):
-        try:
-            if not self.original_image:  # Check if original_image is loaded
-                return
-
-            img = self.original_image.copy()
-            img = ImageEnhance.Brightness(img).enhance(self.brightness)
-            img = ImageEnhance.Contrast(img).enhance(self.contrast)
-            img = ImageEnhance.Brightness(img).enhance(self.exposure)
-
-            if self.distortion != 0:
-                img = self.apply_distortion(img)
-            if self.noise != 0:
-                img = self.apply_noise(img)
-            if self.black_and_white:
-                img = img.convert("L")
-
-            self.processed_image = img  # Update processed_image
-
-        except Exception as e:
-            self.show_error("PROCESSING ERROR", str(e))
-
-    def apply_distortion(self, img):
-        width, height = img.size
-        pixels = np.array(img)
-        for y in range(height):
-            shift = int(self.distortion * 50 * math.sin(y / 10))
-            pixels[y] = np.roll(pixels[y], shift, axis=0)
-        if abs(self.distortion) > 0.5:
-            offset = int(abs(self.distortion) * 20)
-            r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
-            if self.distortion < 0:
-                offset = -offset
-            pixels[..., 0] = np.roll(r, offset)
-            pixels[..., 2] = np.roll(b, -offset)
-        return Image.fromarray(pixels)
-
-    def apply_noise(self, img):
-        pixels = np.array(img).astype(float)
-        noise_level = self.noise * 50
-        noise = np.random.normal(0, noise_level, pixels.shape)
-        pixels = np.clip(pixels + noise, 0, 255).astype(np.uint8)
-        return Image.fromarray(pixels)
+    def update_proxy(self):
+        # (Re)build the working proxy when the grid or preview needs a different
+        # resolution; returns True when the proxy changed
+        if not self.source_path:
+            return False
+        num_cols, num_rows = self.grid_size() or (1, 1)
+        sub_w, sub_h = asci_shape.SUBCELL if self.shape_match.get() else (1, 1)
+        min_size = (max(num_cols * sub_w, asci_engine.PROXY_OVERSAMPLE * max(num_cols, self.preview_width)),
+                    max(num_rows * sub_h, asci_engine.PROXY_OVERSAMPLE * max(num_rows, self.preview_height)))
+        target = asci_engine.proxy_size(self.source_size, min_size)
+
+        # Keep the current proxy while it is big enough and not wastefully large
+        if self.working_image is not None:
+            width, height = self.working_image.size
+            big_enough = width >= target[0] and height >= target[1]
+            if big_enough and (width <= 2 * target[0] or target == self.source_size):
+                return False
+        self.working_image = asci_engine.load_proxy(self.source_path, min_size)
+        return True
+
+    def full_resolution_cells(self, glitch=True):
+        # Exports re-run the whole chain on the full-resolution source, not the
+        # proxy: (grid, highlight marks, colors), or None without a source.
+        # glitch=False stops before the glitch effects.
+        grid = self.grid_size()
+        if not self.source_path or grid is None:
+            return None
+        num_cols, num_rows = grid
+        params = dict(ascii_chars=self.ascii_chars,
+                      invert=self.invert_ascii.get(),
+                      color=self.color_mode.get(),
+                      **self.mapping_params(),
+                      **self.effect_params(),
+                      **(self.text_effect_params() if glitch else {}))
+        key = asci_cache.render_key(self.source_digest, dict(params, grid=grid))
+        cells = self.render_cache.get(key)
+        if cells is not None:
+            return cells
+        width, height = self.source_size
+        if width * height > asci_engine.TILED_MIN_PIXELS:
+            # Very large sources are processed strip by strip and never kept
+            # decoded as a whole RGB copy
+            with Image.open(self.source_path) as img:
+                cells = asci_engine.convert_cells(img, num_cols, num_rows, tiled=True, **params)
+        else:
+            if self.original_image is None:
+                self.original_image = Image.open(self.source_path).convert("RGB")
+            cells = asci_engine.convert_cells(self.original_image, num_cols, num_rows, **params)
+        self.render_cache.put(key, cells)
+        return cells
+
+    def full_resolution_ascii(self):
+        # Export text; in color mode with 24-bit ANSI colors
+        cells = self.full_resolution_cells()
+        if cells is None:
+            return self.ascii_text.get(1.0, tk.END)
+        grid, marks, colors = cells
+        if colors is not None:
+            return "\n".join(asci_engine.grid_to_ansi(grid, self.ascii_chars, colors, marks))
+        return "\n".join(asci_engine.grid_to_lines(grid, self.ascii_chars, marks))
 
     def show_preview(self):
         try:
             if not self.processed_image:  # Check if processed_image is None
                 return  # Exit if no image is loaded
 
-            # Get the dimensions of the preview frame
-            preview_width = self.preview_frame.winfo_width()
-            preview_height = self.preview_frame.winfo_height()
-
-            # Get the dimensions of the original image
-            orig_width, orig_height = self.processed_image.size
-
-            # Calculate the scaling factor to fit the image within the preview area
-            scale = min(
-                preview_width / orig_width,
-                preview_height / orig_height,
-                1.0  # Prevent upscaling beyond original size
-            )
-
-            # Calculate new dimensions while maintaining aspect ratio
-            new_width = int(orig_width * scale)
-            new_height = int(orig_height * scale)
-
-            # Resize the image
-            resized_image = self.processed_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-            # Create a blank image with the size of the preview area
-            blank_image = Image.new("RGB", (preview_width, preview_height), "black")
-
-            # Calculate the position to center the resized image
-            x_offset = (preview_width - new_width) // 2
-            y_offset = (preview_height - new_height) // 2
-
-            # Paste the resized image onto the blank image at the calculated position
-            blank_image.paste(resized_image, (x_offset, y_offset))
-
-            # Convert to PhotoImage and display
-            self.preview_image = ImageTk.PhotoImage(blank_image)
-            self.image_preview.configure(image=self.preview_image)
+            # Fit the processed image into the preview frame
+            preview = asci_engine.fit_preview(self.processed_image,
+                                              self.preview_frame.winfo_width(),
+                                              self.preview_frame.winfo_height(),
+                                              self.pyramid)
+            self.set_preview(preview)
 
         except Exception as e:
             self.show_error("PREVIEW ERROR", str(e))
 
-    def generate_ascii(self, event=None):
-        if not self.processed_image:  # Check if processed_image is None
-            return  # Exit if no image is loaded
-
-        try:
-            self.ascii_text.update_idletasks()
-            widget_width = self.ascii_text.winfo_width()
-            widget_height = self.ascii_text.winfo_height()
+    def set_preview(self, preview):
+        # Reuse the PhotoImage while the preview box keeps its size
+        if self.preview_image is not None and \
+                (self.preview_image.width(), self.preview_image.height()) == preview.size:
+            self.preview_image.paste(preview)
+            return
+        self.preview_image = ImageTk.PhotoImage(preview)
+        self.image_preview.configure(image=self.preview_image)
+
+    def grid_size(self):
+        # Number of character columns/rows that fit the output widget
+        return self.layout.grid_size()
+
+    def effect_params(self):
+        # Current slider state as asci_engine.process_image keyword arguments
+        return {
+            "brightness": self.brightness,
+            "contrast": self.contrast,
+            "exposure": self.exposure,
+            "distortion": self.distortion,
+            "noise": self.noise,
+            "black_and_white": self.black_and_white,
+            "float32": self.float32_pipeline.get(),
+            "noise_frame": self.noise_frame,
+        }
+
+    def text_effect_params(self):
+        # Current Glitch Effects tab state as asci_engine.apply_glitch_effects keyword arguments
+        return {
+            "seed": self.glitch_seed,
+            "wave_text": self.wave_text.get(),
+            "scramble_rows": self.scramble_rows.get(),
+            "rand_char_flip": self.rand_char_flip.get(),
+            "glitch_delay": self.glitch_delay.get(),
+            "noise_ripple": self.noise_ripple.get(),
+            "highlight": self.highlight_effect.get(),
+        }
 
-            if widget_width <= 0 or widget_height <= 0:
-                return
+    def generate_ascii(self, event=None):
+        # Snapshot the current state on the Tk thread and hand it to the render
+        # worker; rapid slider drags coalesce into a single render of the latest state
+        grid = self.grid_size()
+        if not self.working_image or grid is None:
+            return
+        if self.fresh_static.get() and self.noise != 0:
+            self.noise_frame += 1
+        if self.settle_job is not None:
+            self.root.after_cancel(self.settle_job)
+            self.settle_job = None
+        # The proxy is smaller than the source: pixel-space effects are scaled to match
+        effects = dict(self.effect_params(),
+                       pixel_scale=self.working_image.width / self.source_size[0])
+        self.renderer.submit({
+            "image": self.working_image,
+            "effects": effects,
+            "grid": grid,
+            "ascii_chars": self.ascii_chars,
+            "invert": self.invert_ascii.get(),
+            "mapping": self.mapping_params(),
+            "color": self.color_mode.get(),
+            "text_effects": self.text_effect_params(),
+            "source": (self.source_digest, self.working_image.size),
+            # Fresh STATIC draws a new pattern every render, which never repeats
+            "cacheable": not (self.fresh_static.get() and self.noise != 0),
+            "preview_size": (self.preview_frame.winfo_width(), self.preview_frame.winfo_height()),
+        })
 
-            current_font = tkFont.Font(font=self.ascii_text.cget("font"))
-            char_width = current_font.measure("A")
-            line_height = current_font.metrics("linespace")
-
-            num_cols = max(1, widget_width // char_width)
-            num_rows = max(1, widget_height // line_height)
-
-            img = self.processed_image.resize((num_cols, num_rows))
-            img = img.convert("L")
-            pixels = np.array(img)
-
-            # Use inverted mapping if selected
-            ascii_chars = self.ascii_chars[::-1] if self.invert_ascii.get() else self.ascii_chars            
-            ascii_lines = []
-            for row_pixels in pixels:
-                line = "".join([ascii_chars[min(int(p * (len(ascii_chars) - 1) / 255), len(ascii_chars) - 1)] for p in row_pixels])
-                ascii_lines.append(line)
-
-            # Apply effects (wave text, scramble rows, etc.)
-            if self.wave_text.get() > 0:
-                for i in range(len(ascii_lines)):
-                    offset = int(self.wave_text.get() * math.sin(i / 2))
-                    ascii_lines[i] = (" " * abs(offset) + ascii_lines[i]) if offset >= 0 else ascii_lines[i][abs(offset):]
-
-            if self.scramble_rows.get():
-                random.shuffle(ascii_lines)
-
-            if self.rand_char_flip.get() > 0:
-                new_lines = []
-                for line in ascii_lines:
-                    new_line = ""
-                    for ch in line:
-                        if ch != "\n" and random.random() < (self.rand_char_flip.get() / 100):
-                            new_line += random.choice(ascii_chars)
-                        else:
-                            new_line += ch
-                    new_lines.append(new_line)
-                ascii_lines = new_lines
-
-            if self.glitch_delay.get() > 0:
-                glitch_lines = []
-                n = max(1, int(self.glitch_delay.get()))
-                for i, line in enumerate(ascii_lines):
-                    glitch_lines.append(line)
-                    if i % n == 0:
-                        glitch_lines.append(line)
-                ascii_lines = glitch_lines
-
-            if self.noise_ripple.get() > 0:
-                new_lines = []
-                for line in ascii_lines:
-                    line_list = list(line)
-                    for i in range(len(line_list) - 1):
-                        if random.random() < (self.noise_ripple.get() / 50):
-                            line_list[i], line_list[i + 1] = line_list[i + 1], line_list[i]
-                    new_lines.append("".join(line_list))
-                ascii_lines = new_lines
-
-            # Highlight Effect
-            if self.highlight_effect.get() > 0:
-                new_lines = []
-                for line in ascii_lines:
-                    new_line = ""
-                    for ch in line:
-                        if random.random() < (self.highlight_effect.get() / 100):
-                            new_line += f"\033[7m{ch}\033[0m"  # Highlighted text
-                        else:
-                            new_line += ch
-                    new_lines.append(new_line)
-                ascii_lines = new_lines
-
-            ascii_str = "\n".join(ascii_lines)
-            self.ascii_text.delete(1.0, tk.END)
-            self.ascii_text.insert(tk.END, ascii_str)
+    def render_frame(self, state, checkpoint):
+        # Runs on the render thread: no Tk calls in here
+        # Same proxy, settings and grid as a previous session: the cells and the
+        # effect chain output they were mapped from come from disk, unless this
+        # session's pipeline still holds the image
+        cache = self.preview_cache if state["cacheable"] else None
+        cells = store = None
+        processed = self.pipeline.peek(state["image"], **state["effects"])
+        if cache:
+            key = asci_cache.render_key(state["source"], [state[name] for name in (
+                "effects", "grid", "ascii_chars", "invert", "mapping", "color", "text_effects")])
+            image_key = asci_cache.render_key(state["source"], ["image", state["effects"]])
+            cells = cache.get(key)
+            if processed is None and cells is not None:
+                processed = self.read_disk_image(image_key)
+        from_disk = processed is not None and processed is self.disk_image[1]
+        if processed is None:
+            processed = self.pipeline.run(state["image"], **state["effects"])
+        checkpoint()
+
+        # Cached stage outputs are shared objects, so identity tells if the preview
+        # and the pyramid are current
+        if self.render_pyramid is None or self.render_pyramid.image is not processed:
+            self.render_pyramid = asci_engine.ImagePyramid(processed)
+        pyramid = self.render_pyramid
+        if processed is not self.preview_source or state["preview_size"] != self.preview_size:
+            self.preview_source = processed
+            self.preview_size = state["preview_size"]
+            self.preview_frame_image = asci_engine.fit_preview(processed, *self.preview_size, pyramid)
+        checkpoint()
+
+        ascii_chars = state["ascii_chars"]
+        new_cells = None
+        if cells is None:
+            cells = new_cells = self.render_cells(processed, pyramid, state, checkpoint)
+        if cache:
+            # Written later by store_render, once this render has settled
+            new_image = processed if not from_disk and processed is not state["image"] else None
+            if new_cells is not None or new_image is not None:
+                store = (key, new_cells, image_key, new_image)
+        grid, marks, colors = cells
+        return processed, pyramid, self.preview_frame_image, \
+            (asci_engine.grid_to_lines(grid, ascii_chars), colors, marks), store
+
+    def read_disk_image(self, image_key):
+        # The same object while the key stays, so the pyramid and preview memos hold
+        key, img = self.disk_image
+        if key != image_key:
+            img = self.preview_cache.get_image(image_key)
+            if img is not None:
+                self.disk_image = (image_key, img)
+        return img
+
+    def store_render(self, store):
+        # Runs once a render has settled, on a throwaway thread: drags write nothing
+        self.settle_job = None
+        key, cells, image_key, processed = store
+
+        def write():
+            if cells is not None:
+                self.preview_cache.put(key, cells)
+            if processed is not None:
+                self.preview_cache.put_image(image_key, processed)
+        threading.Thread(target=write, daemon=True).start()
+
+    def render_cells(self, processed, pyramid, state, checkpoint):
+        num_cols, num_rows = state["grid"]
+        ascii_chars = state["ascii_chars"]
+        grid = asci_engine.map_grid(processed, num_cols, num_rows, ascii_chars, state["invert"],
+                                    pyramid, **state["mapping"])
+        colors = None
+        if state["color"]:
+            colors = asci_engine.cell_colors(processed, num_cols, num_rows, pyramid=pyramid)
+        checkpoint()
+
+        # Apply effects (wave text, scramble rows, etc.) on the index grid; colors and
+        # highlights travel with the glyphs and become Text tags
+        grid, marks, source = asci_engine.apply_glitch_effects(grid, len(ascii_chars),
+                                                               **state["text_effects"])
+        if colors is not None:
+            colors = asci_engine.follow_cells(colors, source)
+        return grid, marks, colors
+
+    def apply_render(self, result):
+        # Back on the Tk thread with the newest finished render
+        processed, pyramid, preview, (ascii_lines, colors, marks), store = result
+        self.processed_image = processed
+        self.pyramid = pyramid
+        self.set_preview(preview)
+        # Only the rows that differ from the last render are rewritten
+        self.ascii_view.update(ascii_lines, colors, marks)
+        if self.settle_job is not None:
+            self.root.after_cancel(self.settle_job)
+            self.settle_job = None
+        if store is not None:
+            self.settle_job = self.root.after(SETTLE_MS, self.store_render, store)
+
+    def show_render_stats(self):
+        stats = self.renderer.stats()
+        view = self.ascii_view.stats()
+        noise = asci_engine.noise_bank().stats()
+        layout = self.layout.stats()
+        cache = self.render_cache.stats()
+        previews = self.preview_cache.stats()
+        messagebox.showinfo("RENDER STATS", "\n".join([
+            f"SUBMITTED: {stats['submitted']}",
+            f"COMPLETED: {stats['completed']}",
+            f"DROPPED: {stats['dropped']} ({stats['coalesced']} COALESCED, {stats['cancelled']} CANCELLED)",
+            f"FAILED: {stats['failed']}",
+            f"STAGE CACHE: {self.pipeline.hits} HITS / {self.pipeline.misses} MISSES",
+            f"PREVIEW CACHE: {previews['hits']} HITS / {previews['misses']} MISSES, "
+            f"{previews['image_hits']} IMAGE HITS, {previews['writes']} WRITTEN, {previews['evictions']} EVICTED",
+            f"EXPORT CACHE: {cache['hits']} HITS / {cache['misses']} MISSES, "
+            f"{cache['writes']} WRITTEN, {cache['evictions']} EVICTED",
+            f"NOISE BANK: {noise['tiles']} TILES, {noise['bytes'] / 1e6:.1f} MB, "
+            f"{noise['generate_seconds'] * 1000:.0f} MS TO GENERATE, {noise['fields']} USES",
+            f"GRID LAYOUT: {layout['grid_hits']} CACHED / {layout['grid_misses']} COMPUTED, "
+            f"{layout['fonts_measured']} FONT SIZES MEASURED",
+            f"ROWS REWRITTEN: {view['last_rows_rewritten']} LAST FRAME, "
+            f"{view['rows_rewritten']} OVER {view['frames']} FRAMES ({view['full_replaces']} FULL)",
+            f"COLOR TAGS: {view['color_tags']}, {view['last_tag_ranges']} RANGES LAST FRAME",
+        ]), parent=self.root)
 
-        except Exception as e:
-            self.show_error("RENDER ERROR", str(e))
-            
     def export_to_txt(self):
-        ascii_art = self.ascii_text.get(1.0, tk.END)
+        ascii_art = self.full_resolution_ascii()
         if not ascii_art.strip():
             self.show_warning("NO DATA", "Please generate ASCII art before exporting.")
             return
@@ -642,9 +878,21 @@ class ASCIGEN:
             except Exception as e:
                 self.show_error("EXPORT ERROR", str(e))
 
+    def render_ascii_image(self, cells):
+        # Glyphs come from the cached atlas sized from the widget's font metrics,
+        # the grid is built with one tile gather; cells as from full_resolution_cells
+        atlas = self.layout.atlas(self.ascii_chars)
+        if cells is None:
+            return asci_raster.rasterize(self.ascii_text.get(1.0, tk.END).split("\n"), atlas,
+                                         self.text_color, self.bg_color)
+        grid, marks, colors = cells
+        return asci_raster.rasterize(asci_engine.grid_to_lines(grid, self.ascii_chars), atlas,
+                                     self.text_color, self.bg_color,
+                                     colors, asci_engine.color_palette(), marks)
+
     def export_to_jpg(self):
-        ascii_art = self.ascii_text.get(1.0, tk.END)
-        if not ascii_art.strip():
+        cells = self.full_resolution_cells()
+        if cells is None and not self.ascii_text.get(1.0, tk.END).strip():
             self.show_warning("NO DATA", "Please generate ASCII art before exporting.")
             return
 
@@ -655,42 +903,7 @@ class ASCIGEN:
 
         if image_path:
             try:
-                # Get ASCII art dimensions from Tkinter
-                lines = ascii_art.split("\n")
-                num_cols = len(lines[0]) if lines else 0
-                num_rows = len(lines)
-
-                # Get exact font metrics from Tkinter
-                current_font = tkFont.Font(font=self.ascii_text.cget("font"))
-                char_width = current_font.measure("A")
-                line_height = current_font.metrics("linespace")
-
-                # Create fixed-size character grid
-                img_width = num_cols * char_width
-                img_height = num_rows * line_height
-
-                # Get colors
-                bg_color = ImageColor.getrgb(self.bg_color)
-                text_color = ImageColor.getrgb(self.text_color)
-
-                # Create image and draw context
-                img = Image.new("RGB", (img_width, img_height), color=bg_color)
-                draw = ImageDraw.Draw(img)
-
-                # Load EXACT monospace font used in Tkinter
-                try:
-                    font = ImageFont.truetype("Courier.ttf", size=current_font.actual()["size"])
-                except IOError:
-                    font = ImageFont.load_default()
-
-                # Draw character grid
-                for y, line in enumerate(lines):
-                    for x, char in enumerate(line):
-                        # Calculate exact position matching Tkinter layout
-                        x_pos = x * char_width
-                        y_pos = y * line_height
-                        draw.text((x_pos, y_pos), char, font=font, fill=text_color)
-
+                img = self.render_ascii_image(cells)
                 img.save(image_path, "JPEG", quality=95)
                 messagebox.showinfo("EXPORT COMPLETE", f"IMAGE SAVED TO:\n{image_path}")
 
@@ -698,8 +911,13 @@ class ASCIGEN:
                 self.show_error("EXPORT ERROR", str(e))
 
     def export_to_gif(self):
-        ascii_art = self.ascii_text.get(1.0, tk.END)
-        if not ascii_art.strip():
+        # Plain lines plus highlight marks: escapes would be drawn as glyphs
+        cells = self.full_resolution_cells()
+        if cells is None:
+            lines, marks = self.ascii_text.get(1.0, tk.END).split("\n"), None
+        else:
+            lines, marks = asci_engine.grid_to_lines(cells[0], self.ascii_chars), cells[1]
+        if not "".join(lines).strip():
             self.show_warning("NO DATA", "Please generate ASCII art before exporting.")
             return
                 
@@ -710,62 +928,100 @@ class ASCIGEN:
         
         if gif_path:
             try:
-                # Get ASCII art dimensions
-                lines = ascii_art.split("\n")
-                num_cols = len(lines[0]) if lines else 0
-                num_rows = len(lines)
-
-                # Get Tkinter metrics
-                current_font = tkFont.Font(font=self.ascii_text.cget("font"))
-                char_width = current_font.measure("A")
-                line_height = current_font.metrics("linespace")
-
-                # Create base image
-                bg_color = ImageColor.getrgb(self.bg_color)
-                text_color = ImageColor.getrgb(self.text_color)
-                img = Image.new("RGB", (num_cols*char_width, num_rows*line_height), bg_color)
-                
-                # Load font
-                try:
-                    font = ImageFont.truetype("Courier.ttf", current_font.actual()["size"])
-                except IOError:
-                    font = ImageFont.load_default()
-
-                # Create animated frames
-                frames = []
-                for frame in range(10):
-                    draw = ImageDraw.Draw(img.copy())
-                    
-                    # Add glitch effects
-                    for y, line in enumerate(lines):
-                        for x, char in enumerate(line):
-                            offset = int(5 * math.sin(frame + y/2))
-                            if random.random() < 0.1:  # 10% glitch chance
-                                offset += random.randint(-3, 3)
-                            
-                            x_pos = x * char_width + offset
-                            y_pos = y * line_height
-                            draw.text((x_pos, y_pos), char, font=font, fill=text_color)
-                    
-                    frames.append(img)
-
-                # Save GIF
-                frames[0].save(
-                    gif_path,
-                    save_all=True,
-                    append_images=frames[1:],
-                    duration=100,
-                    loop=0,
-                    optimize=True
-                )
+                atlas = self.layout.atlas(self.ascii_chars)
+
+                # Glitch frames are rendered in parallel and share one palette
+                asci_raster.render_glitch_gif(lines, atlas, gif_path,
+                                              self.text_color, self.bg_color,
+                                              frames=self.gif_frames,
+                                              duration=self.gif_duration,
+                                              seed=self.glitch_seed, marks=marks)
                 messagebox.showinfo("EXPORT COMPLETE", f"GIF SAVED TO:\n{gif_path}")
                     
             except Exception as e:
                 self.show_error("EXPORT ERROR", str(e))
 
+    def export_animation(self):
+        if not self.source_path or not asci_frames.is_animated(self.source_path):
+            self.show_warning("NO ANIMATION", "Please load an animated GIF before exporting an animation.")
+            return
+
+        gif_path = filedialog.asksaveasfilename(
+            defaultextension=".gif",
+            filetypes=[("GIF Files", "*.gif"), ("All Files", "*.*")]
+        )
+
+        if gif_path:
+            try:
+                num_cols, num_rows = self.grid_size()
+                atlas = self.layout.atlas(self.ascii_chars)
+
+                # Frames are decoded here and converted in worker processes that read
+                # them from shared memory; TXT frames land next to the GIF
+                with asci_shm.SharedMemoryPool(asci_engine.TILED_WORKERS, asci_shm.THREAD_SAFE_START) as pool:
+                    frames = asci_frames.convert_frame_grids(self.source_path, num_cols, num_rows,
+                                                             fresh_noise=self.fresh_static.get(),
+                                                             pool=pool,
+                                                             ascii_chars=self.ascii_chars,
+                                                             invert=self.invert_ascii.get(),
+                                                             **self.mapping_params(),
+                                                             **self.effect_params(),
+                                                             **self.text_effect_params())
+                    count = asci_frames.export_animation(frames, self.ascii_chars,
+                                                         os.path.splitext(gif_path)[0], gif_path,
+                                                         atlas, self.text_color, self.bg_color)
+                shared = pool.stats()
+                messagebox.showinfo("EXPORT COMPLETE", f"{count} FRAMES SAVED TO:\n{gif_path}\n\n"
+                                    f"{shared['bytes_shared'] / 1e6:.1f} MB SHARED, "
+                                    f"{shared['bytes_pickled'] / 1e3:.1f} KB PICKLED")
+
+            except Exception as e:
+                self.show_error("EXPORT ERROR", str(e))
+
+    def export_to_asca(self):
+        # Compact ASCII animation: the source's frames when it is animated,
+        # otherwise the glitch loop the GIF export renders, as character grids
+        animated = self.source_path and asci_frames.is_animated(self.source_path)
+        cells = None if animated else self.full_resolution_cells(glitch=False)
+        if not animated and cells is None:
+            self.show_warning("NO DATA", "Please load an image before exporting.")
+            return
+
+        asca_path = filedialog.asksaveasfilename(
+            defaultextension=".asca",
+            filetypes=[("ASCII Animations", "*.asca"), ("All Files", "*.*")]
+        )
+
+        if asca_path:
+            try:
+                if animated:
+                    num_cols, num_rows = self.grid_size()
+                    with asci_shm.SharedMemoryPool(asci_engine.TILED_WORKERS, asci_shm.THREAD_SAFE_START) as pool:
+                        frames = asci_frames.convert_frame_grids(self.source_path, num_cols, num_rows,
+                                                                 fresh_noise=self.fresh_static.get(),
+                                                                 pool=pool,
+                                                                 ascii_chars=self.ascii_chars,
+                                                                 invert=self.invert_ascii.get(),
+                                                                 **self.mapping_params(),
+                                                                 **self.effect_params(),
+                                                                 **self.text_effect_params())
+                        stats = asci_anim.write_animation(asca_path, self.ascii_chars, frames)
+                else:
+                    base = cells[0]
+                    frames = asci_engine.glitch_frames(base, len(self.ascii_chars), self.gif_frames,
+                                                       **self.text_effect_params())
+                    stats = asci_anim.write_animation(asca_path, self.ascii_chars,
+                                                      ((grid, marks, self.gif_duration)
+                                                       for grid, marks in frames), base=base)
+                messagebox.showinfo("EXPORT COMPLETE", f"{stats['frames']} FRAMES SAVED TO:\n{asca_path}\n\n"
+                                    f"{stats['bytes'] / 1e3:.1f} KB ({stats['raw_bytes'] / 1e3:.1f} KB OF GRIDS)")
+
+            except Exception as e:
+                self.show_error("EXPORT ERROR", str(e))
+
     def export_to_png(self):
-        ascii_art = self.ascii_text.get(1.0, tk.END)
-        if not ascii_art.strip():
+        cells = self.full_resolution_cells()
+        if cells is None and not self.ascii_text.get(1.0, tk.END).strip():
             self.show_warning("NO DATA", "Please generate ASCII art before exporting.")
             return
 
@@ -776,42 +1032,7 @@ class ASCIGEN:
 
         if image_path:
             try:
-                # Get ASCII art dimensions from Tkinter
-                lines = ascii_art.split("\n")
-                num_cols = len(lines[0]) if lines else 0
-                num_rows = len(lines)
-
-                # Get exact font metrics from Tkinter
-                current_font = tkFont.Font(font=self.ascii_text.cget("font"))
-                char_width = current_font.measure("A")
-                line_height = current_font.metrics("linespace")
-
-                # Create fixed-size character grid
-                img_width = num_cols * char_width
-                img_height = num_rows * line_height
-
-                # Get colors
-                bg_color = ImageColor.getrgb(self.bg_color)
-                text_color = ImageColor.getrgb(self.text_color)
-
-                # Create image and draw context
-                img = Image.new("RGB", (img_width, img_height), color=bg_color)
-                draw = ImageDraw.Draw(img)
-
-                # Load EXACT monospace font used in Tkinter
-                try:
-                    font = ImageFont.truetype("Courier.ttf", size=current_font.actual()["size"])
-                except IOError:
-                    font = ImageFont.load_default()
-
-                # Draw character grid
-                for y, line in enumerate(lines):
-                    for x, char in enumerate(line):
-                        # Calculate exact position matching Tkinter layout
-                        x_pos = x * char_width
-                        y_pos = y * line_height
-                        draw.text((x_pos, y_pos), char, font=font, fill=text_color)
-
+                img = self.render_ascii_image(cells)
                 img.save(image_path, "PNG", compress_level=1)
                 messagebox.showinfo("EXPORT COMPLETE", f"IMAGE SAVED TO:\n{image_path}")
 
@@ -932,6 +1153,7 @@ class ASCIGEN:
         messagebox.showwarning(title, message, parent=self.root)
 
 if __name__ == "__main__":
+    Image.MAX_IMAGE_PIXELS = None  # large scans go through the proxy/tiled paths
     root = tk.Tk()
     app = ASCIGEN(root)
     root.mainloop()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# Native ASCII animation format (.asca): the charset is stored once and every
+# frame is a uint8 index grid (same indices as asci_engine grids). Keyframes
+# hold the whole grid; the frames between them only a bitmask of the cells
+# that differ from a reference grid plus their new values. The reference is
+# whichever differs least of the previous frame, the last keyframe and an
+# optional base grid stored once in the file: glitch effects that grow (chaos
+# sweeps) favour the previous frame, glitch loops re-rolled every frame the
+# unglitched base. Each record is zlib compressed, and an index at the end of
+# the file lets readers seek to the nearest keyframe instead of decoding from
+# the start.
+#
+# Layout, little endian:
+#   b"ASCA", u8 version, u32 header length, header JSON {"charset", "keyframe_interval", "base"}
+#   with "base" true: one b"B" record holding the base grid like a keyframe
+#   per frame: u8 kind, u16 duration ms, u32 payload length, zlib payload
+#     b"K" keyframe payload: u16 rows, u16 cols, grid bytes, marks
+#     b"D" / b"R" / b"S" (against the previous frame / keyframe / base) payload:
+#       positions of the changed cells, their values, marks
+#     marks: positions of the highlighted cells
+#     positions: u32 byte count, then the number of cells skipped before each
+#       position, one byte each (255 adds 255 and continues)
+#   index: u32 frame count, u64 record offset per frame, u8 kind per frame
+#   trailer: u64 index offset, b"ASCX"
+import json
+import struct
+import zlib
+import numpy as np
+import asci_engine
+
+MAGIC = b"ASCA"
+TRAILER_MAGIC = b"ASCX"
+VERSION = 1
+KEYFRAME_INTERVAL = 30  # frames; bounds the deltas decoded for a seek
+DEFAULT_DURATION = 100  # ms
+ZLIB_LEVEL = 9
+
+_RECORD = struct.Struct("<cHI")
+_SHAPE = struct.Struct("<HH")
+_TRAILER = struct.Struct("<Q4s")
+
+
+def _pack_positions(mask):
+    # Sparse cells as skip counts: small numbers zlib squeezes far better than
+    # packed bits or raw offsets
+    positions = np.flatnonzero(mask)
+    gaps = np.diff(positions, prepend=-1) - 1
+    full, rest = np.divmod(gaps, 255)
+    ends = np.cumsum(full + 1) - 1
+    data = np.full(int(ends[-1]) + 1 if len(ends) else 0, 255, dtype=np.uint8)
+    data[ends] = rest
+    return struct.pack("<I", len(data)) + data.tobytes()
+
+
+def _unpack_positions(data, offset=0):
+    # -> (flat positions, offset after them)
+    length, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    skips = np.frombuffer(data, np.uint8, length, offset)
+    ends = np.flatnonzero(skips != 255)
+    gaps = skips[ends].astype(np.int64) + 255 * (np.diff(ends, prepend=-1) - 1)
+    return np.cumsum(gaps + 1) - 1, offset + length
+
+
+def _pack_marks(marks, shape):
+    if marks is None:
+        return b"\0"
+    return b"\1" + _pack_positions(marks.reshape(-1)[:shape[0] * shape[1]])
+
+
+def _unpack_marks(data, offset, shape):
+    if data[offset:offset + 1] != b"\1":
+        return None
+    positions, _ = _unpack_positions(data, offset + 1)
+    marks = np.zeros(shape[0] * shape[1], dtype=bool)
+    marks[positions] = True
+    return marks.reshape(shape)
+
+
+class AnimationWriter:
+    def __init__(self, path, charset, keyframe_interval=KEYFRAME_INTERVAL, base=None):
+        # base: optional grid the frames are variations of (the grid a glitch
+        # loop starts from)
+        if len(charset) > asci_engine.MAX_CHARSET:
+            raise ValueError(f"charset has more than {asci_engine.MAX_CHARSET} characters")
+        self.file = open(path, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.keyframe = None
+        self.base = None
+        self.offsets = []
+        self.kinds = []
+        header = json.dumps({"charset": charset, "keyframe_interval": keyframe_interval,
+                             "base": base is not None}, ensure_ascii=False).encode("utf-8")
+        self.file.write(MAGIC + struct.pack("<BI", VERSION, len(header)) + header)
+        if base is not None:
+            self.base = np.array(base, dtype=np.uint8)
+            self._write_record(b"B", 0, _SHAPE.pack(*self.base.shape) + self.base.tobytes() + _pack_marks(None, None))
+
+        # Counters for tuning
+        self.keyframes = 0
+        self.raw_bytes = 0  # the same frames as uncompressed grids
+
+    def add(self, grid, marks=None, duration=DEFAULT_DURATION):
+        grid = np.ascontiguousarray(grid, dtype=np.uint8)
+        if grid.ndim != 2 or max(grid.shape) > 0xFFFF:
+            raise ValueError("frames must be 2-D grids of at most 65535 rows and columns")
+        keyframe = (self.previous is None or self.previous.shape != grid.shape
+                    or len(self.offsets) % self.keyframe_interval == 0)
+        if keyframe:
+            kind = b"K"
+            payload = _SHAPE.pack(*grid.shape) + grid.tobytes()
+            self.keyframe = grid.copy()
+            self.keyframes += 1
+        else:
+            references = [(b"D", self.previous), (b"R", self.keyframe)]
+            if self.base is not None and self.base.shape == grid.shape:
+                references.append((b"S", self.base))
+            changes = [(np.count_nonzero(mask), kind, mask)
+                       for kind, mask in ((kind, grid != ref) for kind, ref in references)]
+            _, kind, changed = min(changes, key=lambda change: change[0])
+            payload = _pack_positions(changed) + grid[changed].tobytes()
+
+        self.offsets.append(self.file.tell())
+        self.kinds.append(kind)
+        self._write_record(kind, duration, payload + _pack_marks(marks, grid.shape))
+        self.previous = grid.copy()
+        self.raw_bytes += grid.size
+
+    def _write_record(self, kind, duration, payload):
+        payload = zlib.compress(payload, ZLIB_LEVEL)
+        self.file.write(_RECORD.pack(kind, min(int(duration), 0xFFFF), len(payload)))
+        self.file.write(payload)
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(struct.pack("<I", len(self.offsets)))
+        self.file.write(np.array(self.offsets, dtype="<u8").tobytes())
+        self.file.write(b"".join(self.kinds))
+        self.file.write(_TRAILER.pack(index_offset, TRAILER_MAGIC))
+        self.file.close()
+
+    def stats(self):
+        return {
+            "frames": len(self.offsets),
+            "keyframes": self.keyframes,
+            "raw_bytes": self.raw_bytes,
+            "bytes": self.file.tell() if not self.file.closed else None,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AnimationReader:
+    # Frames are read and decoded on demand; iterating holds one grid at a time
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            if self.file.read(4) != MAGIC:
+                raise ValueError(f"{path} is not an ASCII animation")
+            version, header_length = struct.unpack("<BI", self.file.read(5))
+            if version > VERSION:
+                raise ValueError(f"{path} needs a newer reader (format version {version})")
+            header = json.loads(self.file.read(header_length).decode("utf-8"))
+        except BaseException:
+            self.file.close()
+            raise
+        self.charset = header["charset"]
+        self.keyframe_interval = header["keyframe_interval"]
+        self.base = None
+        if header.get("base"):
+            self.base, _, _ = self._decode(self.file.tell(), None, None)
+        self.data_offset = self.file.tell()
+        self.offsets, self.kinds = self._read_index()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        # (grid, marks, duration) per frame
+        grid = keyframe = None
+        for index in range(len(self)):
+            grid, marks, duration = self._decode(self.offsets[index], grid, keyframe)
+            if self.kinds[index] == b"K":
+                keyframe = grid
+            yield grid, marks, duration
+
+    def frame(self, index):
+        # Seek: decode forward from the nearest keyframe at or before index,
+        # skipping frames that no later one refers to
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index
+        while self.kinds[start] != b"K":
+            start -= 1
+        grid = keyframe = None
+        for i in range(start, index + 1):
+            if i == start or i == index or self.kinds[i + 1] == b"D":
+                grid, marks, duration = self._decode(self.offsets[i], grid, keyframe)
+                if i == start:
+                    keyframe = grid
+        return grid, marks, duration
+
+    def lines(self, grid, marks=None):
+        return asci_engine.grid_to_lines(grid, self.charset, marks)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_index(self):
+        # From the trailer; files that were never closed are scanned instead
+        self.file.seek(0, 2)
+        end = self.file.tell()
+        if end - self.data_offset >= _TRAILER.size:
+            self.file.seek(end - _TRAILER.size)
+            index_offset, magic = _TRAILER.unpack(self.file.read(_TRAILER.size))
+            if magic == TRAILER_MAGIC:
+                self.file.seek(index_offset)
+                count, = struct.unpack("<I", self.file.read(4))
+                offsets = np.frombuffer(self.file.read(8 * count), dtype="<u8").tolist()
+                kinds = [bytes([kind]) for kind in self.file.read(count)]
+                return offsets, kinds
+
+        offsets, kinds = [], []
+        position = self.data_offset
+        while position + _RECORD.size <= end:
+            self.file.seek(position)
+            kind, _, length = _RECORD.unpack(self.file.read(_RECORD.size))
+            if kind not in (b"K", b"D", b"R", b"S") or position + _RECORD.size + length > end:
+                break
+            offsets.append(position)
+            kinds.append(kind)
+            position += _RECORD.size + length
+        return offsets, kinds
+
+    def _decode(self, offset, previous, keyframe):
+        self.file.seek(offset)
+        kind, duration, length = _RECORD.unpack(self.file.read(_RECORD.size))
+        data = zlib.decompress(self.file.read(length))
+        if kind == b"R":
+            previous = keyframe
+        elif kind == b"S":
+            previous = self.base
+        if kind in (b"K", b"B"):
+            shape = _SHAPE.unpack_from(data)
+            size = shape[0] * shape[1]
+            grid = np.frombuffer(data, np.uint8, size, _SHAPE.size).reshape(shape).copy()
+            end = _SHAPE.size + size
+        else:
+            shape = previous.shape
+            changed, end = _unpack_positions(data)
+            grid = previous.copy()
+            grid.reshape(-1)[changed] = np.frombuffer(data, np.uint8, len(changed), end)
+            end += len(changed)
+        return grid, _unpack_marks(data, end, shape), duration
+
+
+def write_animation(path, charset, frames, keyframe_interval=KEYFRAME_INTERVAL, base=None):
+    # frames: iterable of (grid, marks, duration); returns the writer's stats
+    with AnimationWriter(path, charset, keyframe_interval, base) as writer:
+        for grid, marks, duration in frames:
+            writer.add(grid, marks, duration)
+        stats = writer.stats()
+    return stats
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# Batch command line converter: turns files, globs or whole directories into
+# ASCII TXT/PNG outputs using a process pool sized to the machine's cores.
+#
+#   python asci_batch.py "test*.jpg" *.png --format txt png --out-dir out
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+import asci_anim
+import asci_cache
+import asci_engine
+import asci_frames
+import asci_ramp
+import asci_raster
+import asci_shape
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif")
+OUTPUT_SUFFIX = "_ascii"
+
+
+def collect_inputs(patterns):
+    # Expand files, globs and directories into a sorted list without duplicates
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(f"no match for {pattern}")
+        for path in matches:
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.normpath(path))
+    return list(dict.fromkeys(paths))
+
+
+def grid_size(image_size, num_cols, num_rows=None, char_aspect=0.5):
+    # Keep the picture's aspect ratio on a grid of roughly twice-as-tall cells
+    width, height = image_size
+    if num_rows is None:
+        num_rows = max(1, int(round(num_cols * height / width * char_aspect)))
+    return num_cols, num_rows
+
+
+def output_path(path, out_dir, extension):
+    stem = os.path.splitext(os.path.basename(path))[0] + OUTPUT_SUFFIX + extension
+    return os.path.join(out_dir or os.path.dirname(path), stem)
+
+
+def options_atlas(options):
+    font = asci_raster.load_font(options["font_size"])
+    char_width, line_height = asci_raster.cell_size(font)
+    return asci_raster.get_atlas(options["font_size"], char_width, line_height,
+                                 options["effects"]["ascii_chars"])
+
+
+def convert_animation(path, options):
+    # Animated inputs: numbered TXT frames, an ASCII GIF and/or an .asca
+    # animation, one decoded frame at a time
+    with Image.open(path) as img:
+        num_cols, num_rows = grid_size(img.size, options["cols"], options["rows"])
+    txt_prefix = None
+    gif_path = None
+    asca_path = None
+    if "txt" in options["formats"]:
+        txt_prefix = os.path.splitext(output_path(path, options["out_dir"], ".txt"))[0]
+    if "png" in options["formats"]:
+        gif_path = output_path(path, options["out_dir"], ".gif")
+    if "asca" in options["formats"]:
+        asca_path = output_path(path, options["out_dir"], ".asca")
+    ascii_chars = options["effects"]["ascii_chars"]
+    grids = asci_frames.convert_frame_grids(path, num_cols, num_rows,
+                                            fresh_noise=options["static_mode"] == "fresh",
+                                            **options["effects"])
+    writer = asci_anim.AnimationWriter(asca_path, ascii_chars) if asca_path else None
+
+    def frames():
+        for grid, marks, duration in grids:
+            if writer:
+                writer.add(grid, marks, duration)
+            yield grid, marks, duration
+
+    try:
+        count = asci_frames.export_animation(frames(), ascii_chars, txt_prefix, gif_path,
+                                             options_atlas(options),
+                                             options["text_color"], options["bg_color"])
+    finally:
+        if writer:
+            writer.close()
+
+    outputs = [asci_frames.frame_path(txt_prefix, i) for i in range(count)] if txt_prefix else []
+    if gif_path:
+        outputs.append(gif_path)
+    if asca_path:
+        outputs.append(asca_path)
+    return outputs
+
+
+def write_glitch_loop(img, num_cols, num_rows, options, path):
+    # Still images as .asca: the glitch effects re-rolled every frame over the
+    # unglitched grid, which is stored once as the delta base
+    mapping = {name: value for name, value in options["effects"].items()
+               if name not in asci_engine.GLITCH_PARAMS}
+    glitch = {name: value for name, value in options["effects"].items()
+              if name in asci_engine.GLITCH_PARAMS}
+    base, _, _ = convert_image(img, num_cols, num_rows, dict(options, effects=mapping, color=False))
+    frames = asci_engine.glitch_frames(base, len(mapping["ascii_chars"]), options["gif_frames"], **glitch)
+    asci_anim.write_animation(path, mapping["ascii_chars"],
+                              ((grid, marks, options["gif_duration"]) for grid, marks in frames),
+                              base=base)
+
+
+def convert_image(img, num_cols, num_rows, options):
+    # (grid, marks, colors) for an opened image; very large ones are processed in strips
+    if options["tiled"] or img.width * img.height > asci_engine.TILED_MIN_PIXELS:
+        return asci_engine.convert_cells(img, num_cols, num_rows, tiled=True,
+                                         color=options["color"], **options["effects"])
+    return asci_engine.convert_cells(img.convert("RGB"), num_cols, num_rows,
+                                     color=options["color"], **options["effects"])
+
+
+def rasterize_cells(cells, options):
+    grid, marks, colors = cells
+    return asci_raster.rasterize(asci_engine.grid_to_lines(grid, options["effects"]["ascii_chars"]),
+                                 options_atlas(options), options["text_color"], options["bg_color"],
+                                 colors, asci_engine.color_palette(), marks)
+
+
+_cache = None
+
+
+def render_cache(options):
+    # One RenderCache per worker process, shared on disk by all of them
+    global _cache
+    if _cache is None:
+        _cache = asci_cache.RenderCache(options["cache_dir"], options["cache_bytes"])
+    return _cache
+
+
+def cached_cells(path, img, num_cols, num_rows, options):
+    # convert_image() through the render cache: (cells, cache key or None, cache hit)
+    if not options["cache"]:
+        return convert_image(img, num_cols, num_rows, options), None, False
+    cache = render_cache(options)
+    key = cache.key(path, dict(options["effects"], cols=num_cols, rows=num_rows, color=options["color"]))
+    cells = cache.get(key)
+    if cells is not None:
+        return cells, key, True
+    cells = convert_image(img, num_cols, num_rows, options)
+    cache.put(key, cells)
+    return cells, key, False
+
+
+def allow_large_images():
+    # Pool initializer: gigapixel scans are expected here, not decompression
+    # bombs. Set in every worker, since spawned ones re-import PIL with its limit.
+    Image.MAX_IMAGE_PIXELS = None
+
+
+def convert_file(path, options):
+    # Runs inside a worker process: decode, convert and write every requested
+    # format. Returns (outputs, bytes read, bytes written, seconds, cache hit).
+    start = time.perf_counter()
+    if options["animate"] and asci_frames.is_animated(path):
+        outputs = convert_animation(path, options)
+        written = sum(os.path.getsize(out) for out in outputs)
+        return outputs, os.path.getsize(path), written, time.perf_counter() - start, False
+
+    img = Image.open(path)
+    num_cols, num_rows = grid_size(img.size, options["cols"], options["rows"])
+    cells, key, cache_hit = cached_cells(path, img, num_cols, num_rows, options)
+    cache = render_cache(options) if options["cache"] else None
+    grid, marks, colors = cells
+    ascii_chars = options["effects"]["ascii_chars"]
+
+    outputs = []
+    if "txt" in options["formats"]:
+        txt_path = output_path(path, options["out_dir"], ".txt")
+        if colors is not None:
+            text_lines = asci_engine.grid_to_ansi(grid, ascii_chars, colors, marks)
+        else:
+            text_lines = asci_engine.grid_to_lines(grid, ascii_chars, marks)
+        with open(txt_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(text_lines))
+        outputs.append(txt_path)
+    if "png" in options["formats"]:
+        png_path = output_path(path, options["out_dir"], ".png")
+        png_key = asci_cache.render_key(key, [options["font_size"], options["text_color"],
+                                              options["bg_color"]]) if cache else None
+        cached_png = cache.get_png(png_key) if cache else None
+        if cached_png:
+            shutil.copyfile(cached_png, png_path)
+        else:
+            img = rasterize_cells(cells, options)
+            img.save(png_path, "PNG", compress_level=1)
+            if cache:
+                cache.put_png(png_key, img)
+        outputs.append(png_path)
+    if "gif" in options["formats"]:
+        gif_path = output_path(path, options["out_dir"], ".gif")
+        asci_raster.render_glitch_gif(asci_engine.grid_to_lines(grid, ascii_chars),
+                                      options_atlas(options), gif_path,
+                                      options["text_color"], options["bg_color"],
+                                      frames=options["gif_frames"],
+                                      duration=options["gif_duration"],
+                                      seed=options["effects"]["seed"], workers=1, marks=marks)
+        outputs.append(gif_path)
+    if "asca" in options["formats"]:
+        asca_path = output_path(path, options["out_dir"], ".asca")
+        write_glitch_loop(img, num_cols, num_rows, options, asca_path)
+        outputs.append(asca_path)
+
+    written = sum(os.path.getsize(out) for out in outputs)
+    return outputs, os.path.getsize(path), written, time.perf_counter() - start, cache_hit
+
+
+def positive_int(value):
+    # argparse type for sizes and counts: 0 or less would fail deep inside the conversion
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert images to ASCII art in parallel.")
+    parser.add_argument("inputs", nargs="+", help="image files, glob patterns or directories")
+    parser.add_argument("-o", "--out-dir", help="write outputs here instead of next to each input")
+    parser.add_argument("-f", "--format", nargs="+", choices=["txt", "png", "gif", "asca"], default=["txt"],
+                        dest="formats", help="gif writes an animated glitch loop, asca the same "
+                                             "as a compact ASCII animation (see asci_anim)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: number of cores)")
+    parser.add_argument("--cols", type=positive_int, default=200)
+    parser.add_argument("--rows", type=positive_int, help="default: derived from the image aspect ratio")
+    parser.add_argument("--font-size", type=positive_int, default=12, help="PNG letter size")
+    parser.add_argument("--animate", action="store_true",
+                        help="convert every frame of animated GIFs (TXT frames and an ASCII GIF)")
+    parser.add_argument("--gif-frames", type=positive_int, default=10)
+    parser.add_argument("--gif-duration", type=int, default=100, help="ms per GIF frame")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always convert, do not read or write the render cache")
+    parser.add_argument("--cache-dir", default=asci_cache.CACHE_DIR)
+    parser.add_argument("--cache-size", type=float, default=asci_cache.CACHE_BYTES / 1024 / 1024,
+                        help="render cache size cap in MB (least recently used renders go first)")
+    parser.add_argument("--tiled", action="store_true",
+                        help="process in memory-bounded strips (automatic above "
+                             f"{asci_engine.TILED_MIN_PIXELS // 1_000_000} megapixels)")
+    parser.add_argument("--text-color", default="#00ff00")
+    parser.add_argument("--bg-color", default="#000000")
+
+    # Same ranges as the Static Effects sliders
+    parser.add_argument("--charset", choices=list(asci_engine.CHARSETS), default="Basic")
+    parser.add_argument("--chars", help="custom charset, densest character first (overrides --charset)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="map luminance by each glyph's measured ink coverage")
+    parser.add_argument("--shape", action="store_true",
+                        help="pick the glyph whose shape best matches each cell")
+    parser.add_argument("--invert", action="store_true")
+    parser.add_argument("--color", action="store_true",
+                        help="color each character from the source (ANSI TXT, colored PNG)")
+    parser.add_argument("--bw", action="store_true", help="black and white")
+    parser.add_argument("--static-mode", choices=["stable", "fresh"], default="stable",
+                        help="fresh: a new STATIC noise pattern for every animation frame")
+    parser.add_argument("--float32", action="store_true",
+                        help="run the effect chain on one in-place float32 buffer")
+    for name in ("brightness", "contrast", "exposure", "glitch", "static"):
+        parser.add_argument(f"--{name}", type=float, default=0, help="-50 to 50")
+
+    # Same ranges as the Glitch Effects tab
+    parser.add_argument("--highlight", type=float, default=0, help="0 to 5")
+    parser.add_argument("--noise-ripple", type=float, default=0, help="0 to 50")
+    parser.add_argument("--glitch-delay", type=float, default=0, help="0 to 50")
+    parser.add_argument("--wave-text", type=float, default=0, help="0 to 20")
+    parser.add_argument("--rand-char-flip", type=float, default=0, help="0 to 100")
+    parser.add_argument("--scramble-rows", action="store_true")
+    parser.add_argument("--seed", type=int, default=0, help="glitch effect random seed")
+    return parser
+
+
+def build_options(args):
+    ascii_chars = asci_ramp.custom_charset(args.chars) if args.chars else asci_engine.CHARSETS[args.charset]
+    effects = {
+        "ascii_chars": ascii_chars,
+        "invert": args.invert,
+        "black_and_white": args.bw,
+        "float32": args.float32,
+        "wave_text": args.wave_text,
+        "scramble_rows": args.scramble_rows,
+        "rand_char_flip": args.rand_char_flip,
+        "glitch_delay": args.glitch_delay,
+        "noise_ripple": args.noise_ripple,
+        "highlight": args.highlight,
+        "seed": args.seed,
+    }
+    for effect_type in ("brightness", "contrast", "exposure", "glitch", "static"):
+        name, value = asci_engine.slider_value(effect_type, getattr(args, effect_type))
+        effects[name] = value
+    if args.calibrate:
+        # Calibrated once here (or read from the disk cache), workers get the table
+        ramp = asci_ramp.calibrate(ascii_chars, size=args.font_size)
+        if ramp.missing:
+            print(f"WARNING: the font cannot draw {len(ramp.missing)} of the charset's glyphs "
+                  f"({ramp.missing[:20]}); --calibrate keeps the stock ramp order", file=sys.stderr)
+        effects["lut"] = ramp.lut_for(args.invert)
+    if args.shape:
+        features = asci_shape.glyph_features(ascii_chars)
+        if features.missing:
+            print(f"WARNING: the font cannot draw {len(features.missing)} of the charset's glyphs "
+                  f"({features.missing[:20]}); --shape falls back to brightness mapping", file=sys.stderr)
+        else:
+            effects["glyph_features"] = features
+    return {
+        "effects": effects,
+        "cols": args.cols,
+        "rows": args.rows,
+        "formats": args.formats,
+        "animate": args.animate,
+        "tiled": args.tiled,
+        "color": args.color,
+        "static_mode": args.static_mode,
+        "out_dir": args.out_dir,
+        "cache": not args.no_cache,
+        "cache_dir": args.cache_dir,
+        "cache_bytes": int(args.cache_size * 1024 * 1024),
+        "font_size": args.font_size,
+        "gif_frames": args.gif_frames,
+        "gif_duration": args.gif_duration,
+        "text_color": args.text_color,
+        "bg_color": args.bg_color,
+    }
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        paths = collect_inputs(args.inputs)
+    except FileNotFoundError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    if not paths:
+        print("ERROR: no images found", file=sys.stderr)
+        return 2
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    try:
+        options = build_options(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    done = failed = bytes_read = bytes_written = cache_hits = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=allow_large_images) as pool:
+        futures = {pool.submit(convert_file, path, options): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                outputs, size_in, size_out, seconds, cache_hit = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done + failed}/{len(paths)}] FAILED {path}: {e}", file=sys.stderr)
+                continue
+            done += 1
+            bytes_read += size_in
+            bytes_written += size_out
+            cache_hits += bool(cache_hit)
+            if len(outputs) > 3:
+                outputs = [outputs[0], "...", f"{outputs[-1]} ({len(outputs)} files)"]
+            print(f"[{done + failed}/{len(paths)}] {path} -> {', '.join(outputs)} ({seconds:.2f}s)")
+
+    elapsed = time.perf_counter() - start
+    print(f"{done} images in {elapsed:.2f}s ({done / elapsed if elapsed else 0:.2f} images/s), "
+          f"{bytes_read / 1e6:.1f} MB read, {bytes_written / 1e6:.1f} MB written, {failed} failed, "
+          f"{cache_hits} cached")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
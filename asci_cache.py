@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# Content-addressed render cache on disk: a render is keyed by a hash of the
+# source file's bytes plus every parameter that shapes the result, and stores
+# the character grid (with highlight marks and cell colors) and optionally the
+# rendered PNG and the effect chain output the grid was mapped from. Files are
+# written under a temporary name and renamed, so several processes (batch
+# workers, the GUI) can share one directory; the least recently used entries
+# are evicted once it grows past its size cap.
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from PIL import Image
+import asci_ramp
+import asci_shape
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(asci_ramp.CACHE_DIR, "renders")
+CACHE_BYTES = 256 * 1024 * 1024
+# Interactive GUI renders (proxy cells and pixels) live apart from the renders
+# shared with asci_batch, so a session cannot evict them
+PREVIEW_CACHE_DIR = os.path.join(asci_ramp.CACHE_DIR, "previews")
+PREVIEW_CACHE_BYTES = 128 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+_digests = {}  # (path, size, mtime) -> file digest, so a file is hashed once per process
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    info = os.stat(path)
+    stamp = (os.path.abspath(path), info.st_size, info.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(stamp)
+    if digest is None:
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _digests_lock:
+            _digests[stamp] = digest
+    return digest
+
+
+def _canonical(value):
+    # Parameters -> JSON-able values; tables and glyph features by content
+    if isinstance(value, asci_shape.GlyphFeatures):
+        value = value.features
+    if isinstance(value, np.ndarray):
+        return ["ndarray", str(value.dtype), list(value.shape),
+                hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()]
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (np.generic, float)):
+        return repr(float(value))
+    return value
+
+
+def render_key(source, params):
+    # source: file digest (or any string naming the input exactly)
+    key = json.dumps([CACHE_VERSION, source, _canonical(params)], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = None  # bytes in the cache as of the last scan plus our own writes
+
+        # Counters for tuning
+        self.hits = 0
+        self.misses = 0
+        self.png_hits = 0
+        self.png_misses = 0
+        self.image_hits = 0
+        self.image_misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def key(self, path, params):
+        return render_key(file_digest(path), params)
+
+    def get(self, key):
+        # (grid, marks, colors) or None; marks and colors may be None
+        path = self._path(key, ".npz")
+        try:
+            with np.load(path) as data:
+                cells = (data["grid"],
+                         data["marks"] if "marks" in data else None,
+                         data["colors"] if "colors" in data else None)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self._touch(path)
+        self.hits += 1
+        return cells
+
+    def put(self, key, cells):
+        grid, marks, colors = cells
+        arrays = {"grid": grid}
+        if marks is not None:
+            arrays["marks"] = marks
+        if colors is not None:
+            arrays["colors"] = colors
+        self._write(self._path(key, ".npz"), lambda f: np.savez_compressed(f, **arrays))
+
+    def get_png(self, key):
+        # Path of the cached PNG, or None
+        path = self._path(key, ".png")
+        if not os.path.exists(path):
+            self.png_misses += 1
+            return None
+        self._touch(path)
+        self.png_hits += 1
+        return path
+
+    def put_png(self, key, img):
+        self._write(self._path(key, ".png"), lambda f: img.save(f, "PNG", compress_level=1))
+
+    def get_image(self, key):
+        # Image stored by put_image, or None
+        path = self._path(key, ".npy")
+        try:
+            pixels = np.load(path)
+        except (OSError, ValueError):
+            self.image_misses += 1
+            return None
+        self._touch(path)
+        self.image_hits += 1
+        return Image.fromarray(pixels)
+
+    def put_image(self, key, img):
+        # Raw pixels: a PNG would take as long to compress as the effect chain
+        # it saves. Keys are content hashes, so an existing file is already right.
+        path = self._path(key, ".npy")
+        if os.path.exists(path):
+            self._touch(path)
+            return
+        pixels = np.asarray(img)
+        self._write(path, lambda f: np.save(f, pixels))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "png_hits": self.png_hits,
+            "png_misses": self.png_misses,
+            "image_hits": self.image_hits,
+            "image_misses": self.image_misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def _path(self, key, extension):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.cache_dir, key[:2], key + extension)
+
+    @staticmethod
+    def _touch(path):
+        # mtime is the LRU clock; atime is often disabled
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write(self, path, save):
+        # Written to a temporary name and renamed, so readers never see half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                save(f)
+            written = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return  # read-only or full disk: the render just is not cached
+        self.writes += 1
+        # The directory is only rescanned when our running estimate passes the
+        # cap; other processes' writes show up at the next scan
+        if self.size is None:
+            self.evict()
+        else:
+            self.size += written
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits max_bytes. Other
+        # processes may delete the same files, so vanished ones are skipped.
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except OSError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self.size = total
@@ -0,0 +1,853 @@
+# -*- coding: utf-8 -*-
+# Headless conversion engine: everything needed to turn a PIL image into ASCII
+# lines without importing tkinter, so it can run on machines without a display.
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from PIL import Image, ImageEnhance
+import numpy as np
+import math
+import os
+import threading
+import time
+
+ASCII_BASIC = "@#MWNQBGFHKEPSAOZXafeowgp][}{?>=<+_;:~-,."
+ASCII_BOX = "█▉▊▋▌▍▎▏▓▒░▐▕▖▗▘▙▚▛▜▝▞▟■□▢▣▤▥▦▧▨▩▪▫▬▭▮▯"  # Block characters
+ASCII_CCC = "中日人木水火山石田土手口目耳足車金玉貝魚鳥犬花草竹空雨電気上下左右中大小出入本文字"
+
+# Names used by the GUI combobox and the command line tools
+CHARSETS = {"Basic": ASCII_BASIC, "Box": ASCII_BOX, "CCC": ASCII_CCC}
+
+
+def slider_value(effect_type, value):
+    # Map a -50..50 effect slider position to the process_image parameter it drives
+    if effect_type == "brightness":
+        return "brightness", 1 + (value / 50.0)
+    elif effect_type == "contrast":
+        return "contrast", 1 + (value / 50.0)
+    elif effect_type == "exposure":
+        return "exposure", 1 + (value / 50.0)
+    elif effect_type == "glitch":
+        return "distortion", value / 50.0
+    elif effect_type == "static":
+        return "noise", abs(value) / 50.0
+    raise ValueError(f"unknown effect: {effect_type}")
+
+
+# Effect chain in application order: (parameter, neutral value, stage function,
+# extra parameters the stage also takes). A stage is skipped at its neutral value.
+STAGES = (
+    ("brightness", 1, lambda img, v: ImageEnhance.Brightness(img).enhance(v), ()),
+    ("contrast", 1, lambda img, v: ImageEnhance.Contrast(img).enhance(v), ()),
+    ("exposure", 1, lambda img, v: ImageEnhance.Brightness(img).enhance(v), ()),
+    ("distortion", 0.0, lambda img, v, scale: apply_distortion(img, v, pixel_scale=scale), ("pixel_scale",)),
+    ("noise", 0.0, lambda img, v, frame, scale: apply_noise(img, v, frame, pixel_scale=scale),
+     ("noise_frame", "pixel_scale")),
+    ("black_and_white", False, lambda img, v: img.convert("L"), ()),
+)
+# pixel_scale: size of the image relative to the source it stands in for (an
+# interactive proxy); GLITCH and STATIC work in pixels and are adjusted for it so
+# the proxy shows what the full-resolution export will
+STAGE_DEFAULTS = {"noise_frame": 0, "pixel_scale": 1.0}
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def process_image(img, brightness=1, contrast=1, exposure=1, distortion=0.0,
+                  noise=0.0, black_and_white=False, float32=False, noise_frame=0, pixel_scale=1.0):
+    # noise_frame picks the STATIC pattern from the noise bank: keep it fixed
+    # for stable noise, change it per render/frame for fresh noise
+    params = locals()
+    if float32:
+        return process_image_float32(img, brightness, contrast, exposure, distortion,
+                                     noise, black_and_white, noise_frame, pixel_scale)
+    for name, neutral, stage, extra in STAGES:
+        if params[name] != neutral:
+            img = stage(img, params[name], *(params[x] for x in extra))
+    return img
+
+
+# Float32 variant of the chain: one working buffer, every stage applied with
+# in-place ufuncs. Each stage still clips and truncates like PIL does between
+# stages, so results match process_image to within rounding.
+LUMA_WEIGHTS = np.array([19595, 38470, 7471], dtype=np.float32) / 65536  # PIL's RGB -> L
+
+
+def _blend_inplace(buf, base, factor):
+    # Image.blend(constant base, img, factor) as used by ImageEnhance
+    if base:
+        buf -= base
+    buf *= factor
+    if base:
+        buf += base
+    np.clip(buf, 0, 255, out=buf)
+    np.floor(buf, out=buf)
+
+
+def _buffer_mean(buf):
+    # Grey mean ImageEnhance.Contrast pivots on, without materializing the L image
+    if buf.ndim == 2:
+        return int(buf.mean(dtype=np.float64) + 0.5)
+    means = buf.reshape(-1, buf.shape[2]).mean(axis=0, dtype=np.float64)
+    return int(float(means[:3] @ LUMA_WEIGHTS) + 0.5)
+
+
+def process_buffer(buf, brightness=1, contrast=1, exposure=1, distortion=0.0, noise=0.0,
+                   noise_frame=0, mean=None, top=0, total_height=None, pixel_scale=1.0):
+    # Everything up to the grey conversion, in place on a float32 (H, W[, C])
+    # buffer. mean/top/total_height are the whole-image values in tiled mode.
+    if brightness != 1:
+        _blend_inplace(buf, 0, brightness)
+    if contrast != 1:
+        _blend_inplace(buf, _buffer_mean(buf) if mean is None else mean, contrast)
+    if exposure != 1:
+        _blend_inplace(buf, 0, exposure)
+    if distortion != 0:
+        distort_inplace(buf, distortion, top, total_height, pixel_scale)
+    if noise != 0:
+        add_noise_inplace(buf, noise, noise_frame, top, pixel_scale)
+    return buf
+
+
+def buffer_to_image(buf, black_and_white=False):
+    if black_and_white and buf.ndim == 3:
+        gray = buf[..., :3] @ LUMA_WEIGHTS
+        gray += 0.5
+        return Image.fromarray(gray.astype(np.uint8))
+    return Image.fromarray(buf.astype(np.uint8))
+
+
+def process_image_float32(img, brightness=1, contrast=1, exposure=1, distortion=0.0,
+                          noise=0.0, black_and_white=False, noise_frame=0, pixel_scale=1.0):
+    # About two full-frame allocations (the buffer and the uint8 result)
+    # instead of one or two per stage
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    buf = np.asarray(img, dtype=np.float32)
+    process_buffer(buf, brightness, contrast, exposure, distortion, noise, noise_frame,
+                   pixel_scale=pixel_scale)
+    return buffer_to_image(buf, black_and_white)
+
+
+class EffectPipeline:
+    # process_image with every stage output memoized, keyed by the chain of
+    # (stage, parameter) pairs that produced it, so moving one slider only
+    # recomputes that stage and the ones after it. Cached images are shared:
+    # callers must not modify them in place.
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.source = None
+        self.cache = OrderedDict()  # key -> image, least recently used first
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.cache.clear()
+        self.cache_bytes = 0
+
+    def run(self, img, float32=False, **params):
+        if img is not self.source:
+            # A new source image invalidates every cached stage
+            self.source = img
+            self.clear()
+
+        params = dict(STAGE_DEFAULTS, **params)
+        if float32:
+            # The fused float32 chain has no intermediate images; only its
+            # final output is memoized
+            key = self._output_key(params, float32)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            cached = process_image_float32(img, **params)
+            self._store(key, cached)
+            return cached
+
+        key = ()
+        for name, neutral, stage, extra in STAGES:
+            value = params.get(name, neutral)
+            if value == neutral:
+                continue
+            extra = tuple(params[x] for x in extra)
+            key = (key, name, value) + extra
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                cached = stage(img, value, *extra)
+                self._store(key, cached)
+            img = cached
+        return img
+
+    def peek(self, img, float32=False, **params):
+        # What run() would return if every stage is already memoized, else
+        # None; never computes anything
+        if img is not self.source:
+            return None
+        key = self._output_key(dict(STAGE_DEFAULTS, **params), float32)
+        if key == ():
+            return img
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+        return cached
+
+    @staticmethod
+    def _output_key(params, float32):
+        # Cache key of the chain's final image; () when every stage is neutral
+        if float32:
+            key = ("float32",) + tuple(params.get(name, neutral) for name, neutral, _, _ in STAGES)
+            return key + tuple(params[x] for x in STAGE_DEFAULTS)
+        key = ()
+        for name, neutral, _, extra in STAGES:
+            value = params.get(name, neutral)
+            if value != neutral:
+                key = (key, name, value) + tuple(params[x] for x in extra)
+        return key
+
+    def _store(self, key, img):
+        size = img.width * img.height * len(img.getbands())
+        if size > self.max_bytes:
+            return
+        self.cache[key] = img
+        self.cache_bytes += size
+        while self.cache_bytes > self.max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+            self.evictions += 1
+
+
+@lru_cache(maxsize=64)
+def _shift_table(height, distortion, pixel_scale=1.0):
+    # Per-row horizontal shift of the glitch warp, cached so repeated ticks at
+    # the same slider value reuse it; a proxy gets the same wave, scaled down
+    rows = np.arange(height) / (10 * pixel_scale)
+    return (distortion * 50 * pixel_scale * np.sin(rows)).astype(np.intp)
+
+
+def _group_rows(shift):
+    order = np.argsort(shift, kind="stable")
+    values, starts = np.unique(shift[order], return_index=True)
+    return list(zip(values.tolist(), np.split(order, starts[1:])))
+
+
+@lru_cache(maxsize=64)
+def _shift_groups(height, distortion, pixel_scale=1.0):
+    # Rows grouped by shift value for whole images
+    return _group_rows(_shift_table(height, distortion, pixel_scale))
+
+
+def _distortion_groups(height, distortion, top, total_height, pixel_scale=1.0):
+    # top/total_height place a horizontal strip inside a taller image (tiled mode)
+    if total_height is None:
+        return _shift_groups(height, distortion, pixel_scale)
+    return _group_rows(_shift_table(total_height, distortion, pixel_scale)[top:top + height])
+
+
+def _chroma_offset(distortion, pixel_scale=1.0):
+    offset = int(abs(distortion) * 20 * pixel_scale)
+    return -offset if distortion < 0 else offset
+
+
+def distort_inplace(buf, distortion, top=0, total_height=None, pixel_scale=1.0):
+    # apply_distortion on an (H, W, C) array; only one row group and one
+    # channel are copied at a time
+    height, width = buf.shape[:2]
+    for shift, rows in _distortion_groups(height, distortion, top, total_height, pixel_scale):
+        shift %= width
+        if shift:
+            buf[rows] = np.roll(buf[rows], shift, axis=1)
+    if abs(distortion) > 0.5 and buf.ndim == 3:
+        offset = _chroma_offset(distortion, pixel_scale)
+        buf[..., 0] = np.roll(buf[..., 0], offset)
+        buf[..., 2] = np.roll(buf[..., 2], -offset)
+    return buf
+
+
+def apply_distortion(img, distortion, top=0, total_height=None, pixel_scale=1.0):
+    pixels = np.asarray(img)
+    height, width = pixels.shape[:2]
+    out = np.empty_like(pixels)
+    groups = _distortion_groups(height, distortion, top, total_height, pixel_scale)
+
+    # Rows sharing a shift move together as two column slices (at most ~100
+    # groups) instead of one np.roll per row
+    for shift, rows in groups:
+        shift %= width
+        block = pixels[rows]
+        out[rows, shift:] = block[:, :width - shift]
+        out[rows, :shift] = block[:, width - shift:]
+
+    if abs(distortion) > 0.5:
+        # Chromatic aberration: red/blue rolled over the flattened image. A
+        # separate pass on purpose: folded into the row-group copies above it
+        # becomes channel-strided slice writes plus the columns that wrap into
+        # the neighbouring row, which measured no faster (slower on proxies)
+        offset = _chroma_offset(distortion, pixel_scale)
+        out[..., 0] = np.roll(out[..., 0], offset)
+        out[..., 2] = np.roll(out[..., 2], -offset)
+    return Image.fromarray(out)
+
+
+# STATIC noise comes from a small bank of seeded float32 Gaussian tiles,
+# generated once and laid over the image with a per-frame tile order and
+# offset, instead of drawing a full-size float64 field on every render
+NOISE_SEED = 0
+NOISE_TILE = 512   # pixels per tile side
+NOISE_TILES = 4    # 4 x 512 x 512 x 3 float32 = 12.6 MB
+
+
+class NoiseBank:
+    def __init__(self, seed=NOISE_SEED, tiles=NOISE_TILES, size=NOISE_TILE):
+        self.seed = seed
+        self.count = tiles
+        self.size = size
+        self.tiles = None
+        self.lock = threading.Lock()
+
+        # Counters for tuning
+        self.generate_seconds = 0.0
+        self.fields = 0     # images noised
+
+    def nbytes(self):
+        return 0 if self.tiles is None else self.tiles.nbytes
+
+    def stats(self):
+        return {
+            "tiles": self.count,
+            "bytes": self.nbytes(),
+            "generate_seconds": self.generate_seconds,
+            "fields": self.fields,
+        }
+
+    def _tiles(self):
+        with self.lock:
+            if self.tiles is None:
+                start = time.perf_counter()
+                rng = np.random.default_rng(self.seed)
+                self.tiles = rng.standard_normal((self.count, self.size, self.size, 3),
+                                                 dtype=np.float32)
+                self.generate_seconds += time.perf_counter() - start
+            self.fields += 1
+            return self.tiles
+
+    def add(self, buf, scale, frame=0, top=0):
+        # buf += scale * unit noise, in place on a float32 (H, W[, C]) buffer.
+        # top is the buffer's first row in the whole image (tiled mode), so
+        # strips get the same noise as the untiled image.
+        tiles = self._tiles()
+        size = self.size
+        height, width = buf.shape[:2]
+        offset_y, offset_x = np.random.default_rng([self.seed, frame]).integers(0, size, 2)
+        scratch = np.empty((size, size) + buf.shape[2:], dtype=np.float32)
+
+        y = 0
+        while y < height:
+            tile_y, row = divmod(top + y + offset_y, size)
+            rows = min(size - row, height - y)
+            x = 0
+            while x < width:
+                tile_x, col = divmod(x + offset_x, size)
+                cols = min(size - col, width - x)
+                tile = tiles[(tile_y * 7 + tile_x * 3 + frame) % self.count, row:row + rows, col:col + cols]
+                if buf.ndim == 2:
+                    tile = tile[..., 0]
+                else:
+                    tile = tile[..., :buf.shape[2]]
+                block = scratch[:rows, :cols]
+                np.multiply(tile, scale, out=block)
+                buf[y:y + rows, x:x + cols] += block
+                x += cols
+            y += rows
+        return buf
+
+
+@lru_cache(maxsize=8)
+def noise_bank(seed=NOISE_SEED):
+    return NoiseBank(seed)
+
+
+NOISE_BIAS_STEP = 0.25  # levels per step of the mean shift table, +-32 levels in all
+
+
+@lru_cache(maxsize=16)
+def _noise_tables(scale, pixel_scale):
+    # Per input level 0..255, the mean and spread of floor(clip(level + scale * n))
+    # for standard normal n, by quadrature. A proxy pixel averages 1/pixel_scale^2
+    # source pixels, which keeps the mean (clipping bias included) and divides
+    # the spread by 1/pixel_scale. Both become uint8 tables for Image.point: the
+    # mean as a shift from the level in NOISE_BIAS_STEP steps around 128, the
+    # spread relative to `unit`.
+    z = np.linspace(-6, 6, 1201)
+    weights = np.exp(-z ** 2 / 2)
+    weights /= weights.sum()
+    levels = np.arange(256)
+    values = np.floor(np.clip(levels[:, None] + scale * z, 0, 255))
+    mean = values @ weights
+    spread = np.sqrt(np.maximum((values ** 2) @ weights - mean ** 2, 0)) * pixel_scale
+    shift = np.clip(np.rint((mean - levels) / NOISE_BIAS_STEP) + 128, 0, 255).astype(np.uint8)
+    unit = max(float(spread.max()), 1e-6) / 255
+    return shift.tolist(), np.rint(spread / unit).astype(np.uint8).tolist(), unit
+
+
+def add_noise_inplace(buf, noise, frame=0, top=0, pixel_scale=1.0):
+    # STATIC on a float32 buffer, clipped and truncated like a PIL stage. A
+    # proxy pixel gets one draw with the mean and spread of the full-resolution
+    # pixels it stands for, so the noise left per character cell matches the
+    # export without noising every source pixel.
+    if pixel_scale >= 1:
+        noise_bank().add(buf, noise * 50, frame, top)
+        np.clip(buf, 0, 255, out=buf)
+        np.floor(buf, out=buf)
+        return buf
+    shift, spread, unit = _noise_tables(noise * 50, pixel_scale)
+    levels = Image.fromarray(buf.astype(np.uint8))
+    bands = len(levels.getbands())
+    field = np.zeros_like(buf)
+    noise_bank().add(field, unit, frame, top)
+    field *= np.asarray(levels.point(spread * bands))
+    field -= 128 * NOISE_BIAS_STEP
+    # buf + (shift - 128) * NOISE_BIAS_STEP + field, without a float copy of the shifts
+    buf /= NOISE_BIAS_STEP
+    buf += np.asarray(levels.point(shift * bands))
+    buf *= NOISE_BIAS_STEP
+    buf += field
+    np.clip(buf, 0, 255, out=buf)
+    return np.rint(buf, out=buf)
+
+
+def apply_noise(img, noise, frame=0, top=0, pixel_scale=1.0):
+    pixels = np.asarray(img, dtype=np.float32)
+    add_noise_inplace(pixels, noise, frame, top, pixel_scale)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+# Tiled mode for very large inputs: the effect chain runs on horizontal strips
+# of about STRIP_PIXELS source pixels, each resampled straight to its rows of
+# the character grid, so effect buffers scale with the strip, not the image
+STRIP_PIXELS = 4_000_000
+TILED_MIN_PIXELS = 50_000_000
+TILED_WORKERS = min(4, os.cpu_count() or 1)  # strips in flight bound peak memory
+
+
+def _contrast(img, factor, mean):
+    # ImageEnhance.Contrast with the grey mean supplied by the caller
+    degenerate = Image.new("L", img.size, mean)
+    if img.mode != "L":
+        degenerate = degenerate.convert(img.mode)
+    return Image.blend(degenerate, img, factor)
+
+
+def map_indices_tiled(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, invert=False,
+                      workers=None, strip_pixels=STRIP_PIXELS, brightness=1, contrast=1,
+                      exposure=1, distortion=0.0, noise=0.0, black_and_white=False,
+                      float32=False, noise_frame=0, lut=None, glyph_features=None, color=False):
+    # Same grid as map_indices(process_image(img, ...)), strip by strip on a
+    # thread pool (PIL and NumPy release the GIL for the heavy work). With
+    # color=True returns (grid, cell_colors(...)) instead.
+    # PIL decoders cannot seek to arbitrary rows, so the source is decoded once
+    # here (in its own mode, usually 3 bytes/pixel or less) before the strips
+    # share it across threads
+    img.load()
+    width, height = img.size
+    scale = height / num_rows
+    halo = int(math.ceil(2 * scale)) + 2  # bicubic support above/below each strip
+    strip_rows = max(1, int(strip_pixels // max(1.0, width * scale)))
+    strips = []
+    for first in range(0, num_rows, strip_rows):
+        last = min(num_rows, first + strip_rows)
+        top = max(0, int(first * scale) - halo)
+        bottom = min(height, int(math.ceil(last * scale)) + halo)
+        strips.append((first, last, top, bottom))
+
+    def brightened(top, bottom):
+        # Converting per strip avoids a full-size RGB copy of palette/grey inputs
+        strip = img.crop((0, top, width, bottom)).convert("RGB")
+        return ImageEnhance.Brightness(strip).enhance(brightness) if brightness != 1 else strip
+
+    with ThreadPoolExecutor(max_workers=workers or TILED_WORKERS) as pool:
+        mean = None
+        if contrast != 1:
+            # Contrast pivots on the grey mean of the whole image: first pass
+            # sums per-strip histograms of the core rows (no halo overlap)
+            def histogram(strip):
+                first, last, _, _ = strip
+                top = int(first * scale) if first else 0
+                bottom = int(last * scale) if last < num_rows else height
+                return np.array(brightened(top, bottom).convert("L").histogram(), dtype=np.int64)
+            counts = sum(pool.map(histogram, strips))
+            mean = int((counts * np.arange(256)).sum() / counts.sum() + 0.5)
+
+        lut = charset_lut(ascii_chars, invert, lut)
+
+        def run(strip):
+            first, last, top, bottom = strip
+            if float32:
+                buf = np.asarray(img.crop((0, top, width, bottom)).convert("RGB"), dtype=np.float32)
+                process_buffer(buf, brightness, contrast, exposure, distortion, noise,
+                               noise_frame, mean, top, height)
+                return resample(buffer_to_image(buf, black_and_white), first, last, top)
+            part = brightened(top, bottom)
+            if contrast != 1:
+                part = _contrast(part, contrast, mean)
+            if exposure != 1:
+                part = ImageEnhance.Brightness(part).enhance(exposure)
+            if distortion != 0:
+                part = apply_distortion(part, distortion, top, height)
+            if noise != 0:
+                part = apply_noise(part, noise, noise_frame, top)
+            if black_and_white:
+                part = part.convert("L")
+            return resample(part, first, last, top)
+
+        def resample(part, first, last, top):
+            box = (0, first * scale - top, width, last * scale - top)
+            colors = None
+            if color:
+                rgb = part.resize((num_cols, last - first), box=box).convert("RGB")
+                colors = quantize_colors(np.asarray(rgb))
+            if glyph_features is not None:
+                sub_w, sub_h = glyph_features.subcell
+                part = part.convert("L").resize((num_cols * sub_w, (last - first) * sub_h), box=box)
+                return glyph_features.match(np.asarray(part), invert), colors
+            part = part.resize((num_cols, last - first), box=box).convert("L")
+            return lut[np.asarray(part)], colors
+
+        grids, colors = zip(*pool.map(run, strips))
+        if color:
+            return np.concatenate(grids), np.concatenate(colors)
+        return np.concatenate(grids)
+
+
+def convert_tiled(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, **params):
+    # convert() for images too large to run the effect chain on in one piece
+    return convert(img, num_cols, num_rows, ascii_chars, tiled=True, **params)
+
+
+# Interactive work happens on a proxy with this many pixels per character cell
+# (or preview pixel) along each axis; only exports touch the full-resolution source
+PROXY_OVERSAMPLE = 2
+
+
+def proxy_size(image_size, min_size):
+    # Smallest aspect-preserving size covering min_size on both axes, never upscaled
+    width, height = image_size
+    scale = min(1.0, max(min_size[0] / width, min_size[1] / height))
+    return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+
+
+def load_proxy(path, min_size):
+    img = Image.open(path)
+    target = proxy_size(img.size, min_size)
+    # JPEG: let libjpeg decode straight at 1/2, 1/4 or 1/8 scale (no-op for other formats)
+    img.draft("RGB", target)
+    img = img.convert("RGB")
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+
+PYRAMID_GAP = 3  # levels used are at least this many times the target size, as
+                 # with PIL's reducing_gap=3 the result is visually indistinguishable
+
+
+class ImagePyramid:
+    # Successive 2x reductions of one image, built on demand and kept for as
+    # long as the image is current, so previews and grid downscales resample
+    # from the nearest level instead of from full resolution every time
+    def __init__(self, img):
+        self.image = img
+        self.levels = [img]
+        self.lock = threading.Lock()  # shared by the render and Tk threads
+
+    def level_for(self, size, gap=PYRAMID_GAP):
+        # Smallest level that is still at least gap * size in both dimensions
+        width, height = size[0] * gap, size[1] * gap
+        with self.lock:
+            index = 0
+            while True:
+                level = self.levels[index]
+                if level.width // 2 < width or level.height // 2 < height:
+                    return level
+                if index + 1 == len(self.levels):
+                    self.levels.append(level.reduce(2))
+                index += 1
+
+
+def fit_preview(img, preview_width, preview_height, pyramid=None):
+    # Fit img inside the preview box (no upscaling), centered on black
+    orig_width, orig_height = img.size
+    scale = min(preview_width / orig_width, preview_height / orig_height, 1.0)
+    new_width = max(1, int(orig_width * scale))
+    new_height = max(1, int(orig_height * scale))
+
+    if pyramid is not None:
+        img = pyramid.level_for((new_width, new_height))
+    resized_image = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    blank_image = Image.new("RGB", (preview_width, preview_height), "black")
+    x_offset = (preview_width - new_width) // 2
+    y_offset = (preview_height - new_height) // 2
+    blank_image.paste(resized_image, (x_offset, y_offset))
+    return blank_image
+
+
+# Index grids: values below len(charset) are glyphs, len(charset) is a padding
+# space (WAVE TEXT) and EMPTY marks cells past the end of a shortened row
+EMPTY = 255
+MAX_CHARSET = 254
+
+
+def build_lut(ascii_chars):
+    # 256-entry luminance -> charset index table, same rounding as the old
+    # per-pixel int(p * (len - 1) / 255) expression
+    n = len(ascii_chars)
+    return np.minimum(np.arange(256) * (n - 1) // 255, n - 1).astype(np.uint8)
+
+
+@lru_cache(maxsize=32)
+def _codepoint_table(ascii_chars):
+    # Code point per grid index; EMPTY and unused entries stay NUL, which NumPy
+    # drops from the end of fixed-width strings
+    if len(ascii_chars) > MAX_CHARSET:
+        raise ValueError(f"charsets are limited to {MAX_CHARSET} characters")
+    table = np.zeros(256, dtype="<u4")
+    table[:len(ascii_chars)] = [ord(ch) for ch in ascii_chars]
+    table[len(ascii_chars)] = ord(" ")
+    return table
+
+
+def charset_lut(ascii_chars, invert=False, lut=None):
+    # A given lut (e.g. a calibrated ramp from asci_ramp) already includes invert
+    if lut is not None:
+        return lut
+    lut = build_lut(ascii_chars)
+
+    # Use inverted mapping if selected (same as indexing the reversed charset)
+    if invert:
+        lut = (len(ascii_chars) - 1 - lut).astype(np.uint8)
+    return lut
+
+
+def map_indices(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, invert=False, pyramid=None,
+                lut=None):
+    # (rows, cols) uint8 grid of charset indices from one LUT indexing pass;
+    # with a pyramid of img the downscale starts from its nearest level
+    if pyramid is not None:
+        img = pyramid.level_for((num_cols, num_rows))
+    img = img.resize((num_cols, num_rows))
+    img = img.convert("L")
+    return charset_lut(ascii_chars, invert, lut)[np.asarray(img)]
+
+
+def map_grid(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, invert=False, pyramid=None,
+             lut=None, glyph_features=None):
+    # map_indices, or shape matching when glyph_features (asci_shape) is given
+    if glyph_features is not None:
+        return glyph_features.map(img, num_cols, num_rows, invert, pyramid)
+    return map_indices(img, num_cols, num_rows, ascii_chars, invert, pyramid, lut)
+
+
+def grid_to_lines(grid, ascii_chars, highlight=None):
+    # Materialize strings once: code points are reinterpreted as one
+    # fixed-width string per row, then highlighted cells get reverse video
+    num_rows, num_cols = grid.shape
+    if num_cols == 0:
+        return [""] * num_rows
+    codes = _codepoint_table(ascii_chars)[grid]
+    ascii_lines = [str(row) for row in np.ascontiguousarray(codes).view(f"<U{num_cols}").ravel()]
+
+    if highlight is not None:
+        for y in np.flatnonzero(highlight.any(axis=1)):
+            cells = list(ascii_lines[y])
+            for x in np.flatnonzero(highlight[y]):
+                cells[x] = f"\033[7m{cells[x]}\033[0m"  # Highlighted text
+            ascii_lines[y] = "".join(cells)
+    return ascii_lines
+
+
+def glitch_frames(grid, n_chars, frames, seed=None, **text_effects):
+    # Glitch loop on one index grid: the glitch effects re-rolled for every
+    # frame with a seed derived from `seed`; yields (grid, marks) per frame
+    for frame in range(frames):
+        frame_grid, marks, _ = apply_glitch_effects(grid, n_chars, None if seed is None else [seed, frame],
+                                                    **text_effects)
+        yield frame_grid, marks
+
+
+# Color mode: each cell gets the RGB of its area quantized to a fixed
+# COLOR_LEVELS^3 cube, so palette indices (and the Tk tags and ANSI codes made
+# from them) mean the same color in every render. NO_COLOR marks cells that
+# have none (padding), which use the plain text color.
+COLOR_LEVELS = 6
+NO_COLOR = -1
+
+
+@lru_cache(maxsize=4)
+def color_palette(levels=COLOR_LEVELS):
+    # (levels^3, 3) uint8 table, index = (r * levels + g) * levels + b
+    steps = np.linspace(0, 255, levels).round().astype(np.uint8)
+    return np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def quantize_colors(rgb, levels=COLOR_LEVELS):
+    q = (rgb.astype(np.uint16) * (levels - 1) + 127) // 255
+    return ((q[..., 0] * levels + q[..., 1]) * levels + q[..., 2]).astype(np.int16)
+
+
+def cell_colors(img, num_cols, num_rows, levels=COLOR_LEVELS, pyramid=None):
+    # (rows, cols) palette indices from the same downscale the glyphs use
+    if pyramid is not None:
+        img = pyramid.level_for((num_cols, num_rows))
+    return quantize_colors(np.asarray(img.resize((num_cols, num_rows)).convert("RGB")), levels)
+
+
+def follow_cells(values, source, fill=NO_COLOR):
+    # Move per-cell values the way apply_glitch_effects moved the glyphs
+    return np.where(source >= 0, values.ravel()[source], fill).astype(values.dtype)
+
+
+def grid_to_ansi(grid, ascii_chars, colors, highlight=None, levels=COLOR_LEVELS):
+    # Lines with 24-bit ANSI foreground colors, one escape per run of equal
+    # color (and highlight) rather than per character
+    palette = color_palette(levels)
+    ascii_lines = grid_to_lines(grid, ascii_chars)
+    for y, line in enumerate(ascii_lines):
+        if not line:
+            continue
+        style = colors[y, :len(line)].astype(np.int32) * 2
+        if highlight is not None:
+            style += highlight[y, :len(line)]
+        starts = np.flatnonzero(np.r_[True, style[1:] != style[:-1]]).tolist()
+        parts = []
+        for start, end in zip(starts, starts[1:] + [len(line)]):
+            codes = ["0"]
+            if highlight is not None and highlight[y, start]:
+                codes.append("7")
+            if colors[y, start] >= 0:
+                r, g, b = palette[colors[y, start]]
+                codes.append(f"38;2;{r};{g};{b}")
+            parts.append(f"\033[{';'.join(codes)}m{line[start:end]}")
+        ascii_lines[y] = "".join(parts) + "\033[0m"
+    return ascii_lines
+
+
+def image_to_lines(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, invert=False):
+    return grid_to_lines(map_indices(img, num_cols, num_rows, ascii_chars, invert), ascii_chars)
+
+
+def _ripple_columns(swap):
+    # NOISE RIPPLE swaps cell i with i + 1 left to right, so a run of swaps
+    # starting at a carries cell a to the end of the run while the cells in
+    # between move one step left; returns the source column of every cell
+    num_rows, width = swap.shape[0], swap.shape[1] + 1
+    k = np.arange(width - 1)
+    starts = swap.copy()
+    starts[:, 1:] &= ~swap[:, :-1]
+    run_start = np.maximum.accumulate(np.where(starts, k, 0), axis=1)
+
+    cols = np.broadcast_to(np.arange(width), (num_rows, width)).copy()
+    cols[:, :-1] = np.where(swap, k + 1, cols[:, :-1])
+    run_end = swap.copy()
+    run_end[:, :-1] &= ~swap[:, 1:]
+    cols[:, 1:] = np.where(run_end, run_start, cols[:, 1:])
+    return cols
+
+
+# apply_glitch_effects keyword arguments, as found among convert() parameters
+GLITCH_PARAMS = ("seed", "wave_text", "scramble_rows", "rand_char_flip", "glitch_delay",
+                 "noise_ripple", "highlight")
+
+
+def apply_glitch_effects(grid, n_chars, seed=None, wave_text=0, scramble_rows=False,
+                         rand_char_flip=0, glitch_delay=0, noise_ripple=0, highlight=0):
+    # Glitch Effects tab on an index grid. All randomness comes from one
+    # Generator, so equal parameters and seed give identical output.
+    # Returns (grid, highlight mask or None, source) where source holds the flat
+    # index of the original cell each output cell came from (-1 for padding).
+    rng = np.random.default_rng(seed)
+    num_rows, num_cols = grid.shape
+    source = np.arange(num_rows * num_cols, dtype=np.int32).reshape(num_rows, num_cols)
+    row_ids = np.arange(num_rows)[:, None]
+
+    if wave_text > 0 and num_cols:
+        offsets = (wave_text * np.sin(np.arange(num_rows) / 2)).astype(np.intp)
+        width = num_cols + max(0, int(offsets.max()))
+        cols = np.arange(width) - offsets[:, None]
+        inside = (cols >= 0) & (cols < num_cols)
+        # Leading cells of right-shifted rows are spaces, the rest past the row is EMPTY
+        padding = np.where(cols < 0, n_chars, EMPTY).astype(np.uint8)
+        cols = np.clip(cols, 0, num_cols - 1)
+        grid = np.where(inside, grid[row_ids, cols], padding)
+        source = np.where(inside, source[row_ids, cols], -1)
+
+    if scramble_rows:
+        order = rng.permutation(num_rows)
+        grid = grid[order]
+        source = source[order]
+
+    if rand_char_flip > 0:
+        flip = (grid != EMPTY) & (rng.random(grid.shape) < (rand_char_flip / 100))
+        grid = np.where(flip, rng.integers(0, n_chars, grid.shape, dtype=np.uint8), grid)
+
+    if glitch_delay > 0:
+        n = max(1, int(glitch_delay))
+        repeats = np.where(np.arange(len(grid)) % n == 0, 2, 1)
+        grid = np.repeat(grid, repeats, axis=0)
+        source = np.repeat(source, repeats, axis=0)
+
+    if noise_ripple > 0 and grid.shape[1] > 1:
+        swap = (grid[:, 1:] != EMPTY) & (rng.random((grid.shape[0], grid.shape[1] - 1)) < (noise_ripple / 50))
+        cols = _ripple_columns(swap)
+        grid = np.take_along_axis(grid, cols, axis=1)
+        source = np.take_along_axis(source, cols, axis=1)
+
+    marks = None
+    if highlight > 0:
+        marks = (grid != EMPTY) & (rng.random(grid.shape) < (highlight / 100))
+    return grid, marks, source
+
+
+def convert_cells(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, invert=False,
+                  brightness=1, contrast=1, exposure=1, distortion=0.0, noise=0.0,
+                  black_and_white=False, float32=False, noise_frame=0, lut=None,
+                  glyph_features=None, color=False, tiled=False, workers=None, **text_effects):
+    # Full image -> (grid, highlight marks or None, cell colors or None);
+    # text_effects are the apply_glitch_effects keyword arguments, including
+    # seed. lut replaces the linear luminance -> charset mapping (see
+    # asci_ramp), glyph_features switches to shape matching (see asci_shape),
+    # tiled runs the effect chain strip by strip (map_indices_tiled).
+    colors = None
+    if tiled:
+        grid = map_indices_tiled(img, num_cols, num_rows, ascii_chars, invert, workers,
+                                 brightness=brightness, contrast=contrast, exposure=exposure,
+                                 distortion=distortion, noise=noise, black_and_white=black_and_white,
+                                 float32=float32, noise_frame=noise_frame, lut=lut,
+                                 glyph_features=glyph_features, color=color)
+        if color:
+            grid, colors = grid
+    else:
+        img = process_image(img, brightness, contrast, exposure, distortion, noise, black_and_white,
+                            float32, noise_frame)
+        grid = map_grid(img, num_cols, num_rows, ascii_chars, invert, lut=lut,
+                        glyph_features=glyph_features)
+        if color:
+            colors = cell_colors(img, num_cols, num_rows)
+    grid, marks, source = apply_glitch_effects(grid, len(ascii_chars), **text_effects)
+    if colors is not None:
+        colors = follow_cells(colors, source)
+    return grid, marks, colors
+
+
+def convert(img, num_cols, num_rows, ascii_chars=ASCII_BASIC, **params):
+    # Full image -> text lines in one call, see convert_cells
+    grid, marks, _ = convert_cells(img, num_cols, num_rows, ascii_chars, **params)
+    return grid_to_lines(grid, ascii_chars, marks)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Animated input support: frames of GIFs such as ff.gif are decoded lazily and
+# pushed through the effect chain and ASCII mapping one at a time.
+from collections import deque
+from PIL import Image, ImageSequence
+import queue
+import threading
+import asci_engine
+import asci_raster
+import asci_shm
+
+DEFAULT_DURATION = 100  # ms, used when a frame carries no duration
+PREFETCH_FRAMES = 4
+
+
+def is_animated(path):
+    with Image.open(path) as img:
+        return getattr(img, "is_animated", False)
+
+
+def iter_frames(path):
+    # Decode one frame at a time; only the current frame is held by this generator
+    with Image.open(path) as img:
+        for frame in ImageSequence.Iterator(img):
+            duration = frame.info.get("duration", img.info.get("duration", DEFAULT_DURATION))
+            yield frame.convert("RGB"), duration or DEFAULT_DURATION
+
+
+def prefetch(iterable, maxsize=PREFETCH_FRAMES):
+    # Run `iterable` on a background thread through a bounded queue, so decoding
+    # overlaps conversion while at most `maxsize` items are ever waiting
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+        except Exception as e:
+            items.put((done, e))
+            return
+        items.put((done, None))
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def convert_frames(path, num_cols, num_rows, prefetch_frames=PREFETCH_FRAMES, seed=None,
+                   fresh_noise=False, pool=None, **params):
+    # Yields (ascii_lines, duration) per frame; params are the asci_engine.convert
+    # ones. Each frame gets its own glitch seed derived from `seed`, and with
+    # fresh_noise its own STATIC pattern from the noise bank. With an
+    # asci_shm.SharedMemoryPool the effect chain and mapping of several frames
+    # run in parallel worker processes.
+    ascii_chars = params.get("ascii_chars", asci_engine.ASCII_BASIC)
+    for grid, marks, duration in convert_frame_grids(path, num_cols, num_rows, prefetch_frames,
+                                                     seed, fresh_noise, pool, **params):
+        yield asci_engine.grid_to_lines(grid, ascii_chars, marks), duration
+
+
+def convert_frame_grids(path, num_cols, num_rows, prefetch_frames=PREFETCH_FRAMES, seed=None,
+                        fresh_noise=False, pool=None, **params):
+    # convert_frames() before the strings are built: (grid, marks, duration) per frame
+    frames = prefetch(iter_frames(path), prefetch_frames)
+    noise_frame = params.pop("noise_frame", 0)
+    if pool is not None:
+        yield from _convert_frames_shared(frames, num_cols, num_rows, pool, seed, fresh_noise,
+                                          noise_frame, params)
+        return
+    for index, (frame, duration) in enumerate(frames):
+        frame_seed = None if seed is None else [seed, index]
+        if fresh_noise:
+            noise_frame = index
+        grid, marks, _ = asci_engine.convert_cells(frame, num_cols, num_rows, seed=frame_seed,
+                                                   noise_frame=noise_frame, **params)
+        yield grid, marks, duration
+
+
+def _convert_frames_shared(frames, num_cols, num_rows, pool, seed, fresh_noise, noise_frame, params):
+    # Up to two frames per worker are in flight; glitch effects are applied
+    # here, in frame order
+    mapping = {name: params.pop(name) for name in asci_shm.MAP_PARAMS if name in params}
+    ascii_chars = mapping.get("ascii_chars", asci_engine.ASCII_BASIC)
+    pending = deque()
+    frames = enumerate(frames)
+    while True:
+        while len(pending) < 2 * pool.workers:
+            index, (frame, duration) = next(frames, (None, (None, None)))
+            if frame is None:
+                break
+            if fresh_noise:
+                noise_frame = index
+            pending.append((index, pool.submit(frame, num_cols, num_rows,
+                                               noise_frame=noise_frame, **mapping), duration))
+        if not pending:
+            return
+        index, task, duration = pending.popleft()
+        frame_seed = None if seed is None else [seed, index]
+        grid, marks, _ = asci_engine.apply_glitch_effects(task.result(), len(ascii_chars),
+                                                          seed=frame_seed, **params)
+        yield grid, marks, duration
+
+
+def frame_path(prefix, index):
+    return f"{prefix}_{index:04d}.txt"
+
+
+def export_animation(frames, ascii_chars, txt_prefix=None, gif_path=None, atlas=None,
+                     text_color="#00ff00", bg_color="#000000"):
+    # Consume a convert_frame_grids() stream once, writing numbered TXT frames
+    # and/or a GIF whose frames share one palette; each GIF frame is written
+    # as soon as it is rasterized. Returns the number of frames written.
+    gif = asci_raster.GifWriter(gif_path) if gif_path else None
+    count = 0
+    try:
+        for index, (grid, marks, duration) in enumerate(frames):
+            count += 1
+            if txt_prefix:
+                with open(frame_path(txt_prefix, index), "w", encoding="utf-8") as f:
+                    f.write("\n".join(asci_engine.grid_to_lines(grid, ascii_chars, marks)))
+            if gif:
+                gif.add(asci_raster.rasterize_palette(asci_engine.grid_to_lines(grid, ascii_chars), atlas,
+                                                      text_color, bg_color, marks=marks), duration)
+    finally:
+        if gif:
+            gif.close()
+    return count
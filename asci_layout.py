@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Layout service for the DIGITAL OUTPUT text widget: font metrics are measured
+# once per (family, size) and the character grid once per widget geometry, so
+# renders and exports never force a Tk layout pass or re-measure the font.
+import tkinter.font as tkFont
+import asci_raster
+
+_metrics_cache = {}
+
+
+def font_metrics(family, size):
+    # (actual point size, character width, line height) of a Tk font
+    key = (family, size)
+    metrics = _metrics_cache.get(key)
+    if metrics is None:
+        font = tkFont.Font(family=family, size=size)
+        metrics = (font.actual()["size"], font.measure("A"), font.metrics("linespace"))
+        _metrics_cache[key] = metrics
+    return metrics
+
+
+class TextLayout:
+    def __init__(self, text, family, size):
+        self.text = text
+        self.family = family
+        self.size = size
+        self.geometry = None  # (width, height) from the last <Configure>
+        self.grid = None
+
+        # Counters for tuning
+        self.grid_hits = 0
+        self.grid_misses = 0
+
+    def on_configure(self, event):
+        # Bound to the widget's <Configure>; only a real size change resets the grid
+        geometry = (event.width, event.height)
+        if geometry != self.geometry:
+            self.geometry = geometry
+            self.grid = None
+
+    def set_font(self, family, size):
+        # Returns True when the font actually changed
+        if (family, size) == (self.family, self.size):
+            return False
+        self.family = family
+        self.size = size
+        self.text.configure(font=(family, size))
+        self.grid = None
+        return True
+
+    def metrics(self):
+        return font_metrics(self.family, self.size)
+
+    def grid_size(self):
+        # Number of character columns/rows that fit the widget, or None before
+        # it has been laid out
+        if self.grid is not None:
+            self.grid_hits += 1
+            return self.grid
+        self.grid_misses += 1
+        if self.geometry is None:
+            # Before the first <Configure>: whatever geometry Tk has, no forced layout
+            width, height = self.text.winfo_width(), self.text.winfo_height()
+            if width <= 1 or height <= 1:
+                return None
+        else:
+            width, height = self.geometry
+        if width <= 0 or height <= 0:
+            return None
+
+        _, char_width, line_height = self.metrics()
+        self.grid = (max(1, width // char_width), max(1, height // line_height))
+        return self.grid
+
+    def atlas(self, charset=""):
+        # Glyph atlas matching the widget's cells; fonts and atlases are cached
+        # by asci_raster per size
+        size, char_width, line_height = self.metrics()
+        return asci_raster.get_atlas(size, char_width, line_height, charset)
+
+    def stats(self):
+        return {
+            "grid_hits": self.grid_hits,
+            "grid_misses": self.grid_misses,
+            "fonts_measured": len(_metrics_cache),
+        }
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+# Terminal player: plays ASCII frames on stdout at a target frame rate.
+# Sources are .asca animations, TXT exports (ANSI colors and highlights
+# included), and images or animated GIFs converted on the fly; --chaos plays a
+# still source as the GUI's RANDOM FLIP sweep. After the first frame only the
+# cells that changed are redrawn, one cursor-positioning escape per run of
+# changed cells, and each frame goes out in a single write. Frames the
+# terminal cannot keep up with are dropped rather than queued.
+#
+#   python asci_play.py test2.gif --fps 15 --loop 0
+#   python asci_play.py out/test_ascii.asca
+#   python asci_play.py test.jpg --chaos --color --glitch 10
+#   python asci_play.py out/test2_ascii_*.txt
+#
+# Every asci_batch flag (--charset, --cols, effects, ...) works here as well;
+# without --cols the picture is fitted to the terminal.
+from functools import lru_cache
+from PIL import Image
+import os
+import re
+import shutil
+import sys
+import time
+import unicodedata
+import numpy as np
+import asci_anim
+import asci_batch
+import asci_engine
+import asci_frames
+
+CHAOS_LEVELS = list(range(-50, 55, 5)) + list(range(45, -50, -5))  # RANDOM FLIP, up and back
+CHAOS_DURATION = 100  # ms, the GUI's chaos animation step
+MERGE_GAP = 6    # unchanged cells shorter than a cursor escape are rewritten instead
+MAX_DROPPED = 4  # frames dropped in a row before one is drawn late anyway
+
+_SGR = re.compile(r"\033\[([0-9;]*)m")
+
+
+@lru_cache(maxsize=32)
+def _cell_tables(ascii_chars):
+    # Code point and terminal width per grid index. Padding, EMPTY, control and
+    # zero-width characters (which a terminal merges into the cell before them)
+    # are drawn as spaces, so every cell owns at least one column.
+    codes = np.full(256, ord(" "), dtype="<u4")
+    widths = np.ones(256, dtype=np.int32)
+    for index, ch in enumerate(ascii_chars):
+        if unicodedata.category(ch) in ("Cc", "Cf", "Mn", "Me"):
+            continue
+        codes[index] = ord(ch)
+        if unicodedata.east_asian_width(ch) in ("W", "F"):
+            widths[index] = 2
+    return codes, widths
+
+
+def parse_text(text):
+    # TXT export -> (grid, marks, colors, charset), undoing the reverse video
+    # and 24-bit colors asci_engine writes; marks/colors are None without any
+    rows = []
+    for line in text.rstrip("\n").split("\n"):
+        cells = []
+        reverse, color = False, asci_engine.NO_COLOR
+        position = 0
+        for match in list(_SGR.finditer(line)) + [None]:
+            end = match.start() if match else len(line)
+            cells += [(ch, reverse, color) for ch in line[position:end] if ch != "\r"]
+            if match is None:
+                break
+            position = match.end()
+            codes = match.group(1).split(";")
+            i = 0
+            while i < len(codes):
+                code = codes[i]
+                if code in ("", "0"):
+                    reverse, color = False, asci_engine.NO_COLOR
+                elif code == "7":
+                    reverse = True
+                elif code == "27":
+                    reverse = False
+                elif code == "39":
+                    color = asci_engine.NO_COLOR
+                elif code == "38" and codes[i + 1:i + 2] == ["2"] and len(codes) >= i + 5:
+                    rgb = np.array([min(int(c or 0), 255) for c in codes[i + 2:i + 5]], dtype=np.uint8)
+                    color = int(asci_engine.quantize_colors(rgb))
+                    i += 4
+                i += 1
+        rows.append(cells)
+
+    charset = "".join(dict.fromkeys(ch for cells in rows for ch, _, _ in cells))
+    if len(charset) > asci_engine.MAX_CHARSET:
+        raise ValueError(f"more than {asci_engine.MAX_CHARSET} different characters")
+    index = {ch: i for i, ch in enumerate(charset)}
+    shape = (len(rows), max((len(cells) for cells in rows), default=0))
+    grid = np.full(shape, len(charset), dtype=np.uint8)
+    marks = np.zeros(shape, dtype=bool)
+    colors = np.full(shape, asci_engine.NO_COLOR, dtype=np.int16)
+    for y, cells in enumerate(rows):
+        for x, (ch, reverse, color) in enumerate(cells):
+            grid[y, x] = index[ch]
+            marks[y, x] = reverse
+            colors[y, x] = color
+    return (grid, marks if marks.any() else None,
+            colors if (colors != asci_engine.NO_COLOR).any() else None, charset)
+
+
+def chaos_frames(grid, colors, n_chars, seed=None, **text_effects):
+    # The GUI's chaos animation: RANDOM FLIP swept up and back over one grid
+    for level in CHAOS_LEVELS:
+        frame_grid, marks, source = asci_engine.apply_glitch_effects(
+            grid, n_chars, seed, rand_char_flip=max(level, 0), **text_effects)
+        frame_colors = None if colors is None else asci_engine.follow_cells(colors, source)
+        yield frame_grid, marks, frame_colors, CHAOS_DURATION
+
+
+def _replay(make):
+    # frames() streams from make() the first time and replays the recorded
+    # frames on later loops, so conversions run once
+    recorded = []
+    complete = []
+
+    def record():
+        recorded.clear()
+        for frame in make():
+            recorded.append(frame)
+            yield frame
+        complete.append(True)
+
+    def frames():
+        return iter(recorded) if complete else record()
+    return frames
+
+
+def fit_grid(image_size, options, charset, terminal):
+    # --cols/--rows when given, otherwise the largest grid that fits the terminal
+    if options["cols"]:
+        return asci_batch.grid_size(image_size, options["cols"], options["rows"])
+    cell_width = int(_cell_tables(charset)[1][:len(charset)].max(initial=1))
+    num_cols = max(1, terminal.columns // cell_width)
+    num_cols, num_rows = asci_batch.grid_size(image_size, num_cols, options["rows"])
+    if num_rows > terminal.lines - 1 and not options["rows"]:
+        num_cols, num_rows = asci_batch.grid_size(
+            image_size, max(1, num_cols * (terminal.lines - 1) // num_rows))
+    return num_cols, num_rows
+
+
+def open_source(path, options, chaos=False, terminal=None):
+    # -> (charset, frames) where frames() yields (grid, marks, colors, duration)
+    terminal = terminal or shutil.get_terminal_size()
+    effects = options["effects"]
+    charset = effects["ascii_chars"]
+    glitch = {name: value for name, value in effects.items() if name in asci_engine.GLITCH_PARAMS}
+    chaos_effects = {name: value for name, value in glitch.items() if name != "rand_char_flip"}
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".asca":
+        with asci_anim.AnimationReader(path) as reader:
+            charset = reader.charset
+
+        def frames():
+            with asci_anim.AnimationReader(path) as reader:
+                for grid, marks, duration in reader:
+                    yield grid, marks, None, duration or asci_anim.DEFAULT_DURATION
+        return charset, frames
+
+    if extension == ".txt":
+        with open(path, encoding="utf-8") as f:
+            grid, marks, colors, charset = parse_text(f.read())
+        if chaos:
+            return charset, _replay(lambda: chaos_frames(grid, colors, len(charset), **chaos_effects))
+        return charset, lambda: iter([(grid, marks, colors, asci_anim.DEFAULT_DURATION)])
+
+    img = Image.open(path)
+    num_cols, num_rows = fit_grid(img.size, options, charset, terminal)
+    if asci_frames.is_animated(path) and not chaos:
+        img.close()
+
+        def convert():
+            for grid, marks, duration in asci_frames.convert_frame_grids(
+                    path, num_cols, num_rows, fresh_noise=options["static_mode"] == "fresh", **effects):
+                yield grid, marks, None, duration or asci_anim.DEFAULT_DURATION
+        return charset, _replay(convert)
+
+    if chaos:
+        # The sweep starts from the grid before any glitch effect
+        mapping = {name: value for name, value in effects.items() if name not in glitch}
+        base, _, colors = asci_batch.convert_image(img, num_cols, num_rows, dict(options, effects=mapping))
+        return charset, _replay(lambda: chaos_frames(base, colors, len(charset), **chaos_effects))
+    grid, marks, colors = asci_batch.cached_cells(path, img, num_cols, num_rows, options)[0]
+    return charset, lambda: iter([(grid, marks, colors, asci_anim.DEFAULT_DURATION)])
+
+
+class TerminalScreen:
+    # Keeps what is on screen and turns each new frame into the escapes and
+    # characters that bring the terminal from one to the other
+    def __init__(self, out, full_redraw=False):
+        self.out = out  # binary stream
+        self.full_redraw = full_redraw
+        self.codes = None    # (rows, cols) code points on screen
+        self.styles = None   # (rows, cols) (palette index + 1) * 2 + highlight
+        self.columns = None  # (rows, cols) terminal column of each cell
+        self.row_ends = None
+        self.style = None    # SGR state of the terminal
+        self.sgr = {}        # style -> escape
+
+        # Counters for tuning
+        self.frames = 0
+        self.bytes = 0
+        self.cells = 0        # cells written, including merged unchanged gaps
+        self.moves = 0        # cursor-positioning escapes
+        self.full_frames = 0  # frames drawn from a cleared screen
+        self.full_bytes = 0   # bytes of those frames
+        self.write_seconds = 0.0
+
+    def draw(self, grid, charset, marks=None, colors=None):
+        code_table, width_table = _cell_tables(charset)
+        codes = code_table[grid]
+        widths = width_table[grid]
+        styles = np.zeros(grid.shape, dtype=np.int32)
+        if colors is not None:
+            styles += (colors.astype(np.int32) + 1) * 2
+        if marks is not None:
+            styles += marks
+        columns = np.cumsum(widths, axis=1) - widths
+        row_ends = columns[:, -1] + widths[:, -1] if grid.shape[1] else np.zeros(grid.shape[0], np.int32)
+
+        full = self.full_redraw or self.codes is None or self.codes.shape != codes.shape
+        parts = []
+        if full:
+            parts.append("\033[0m\033[2J")
+            self.style = 0
+            changed = np.ones(grid.shape, dtype=bool)
+            shrunk = np.zeros(grid.shape[0], dtype=bool)
+        else:
+            # A cell is redrawn when it, its style or its column (wide glyphs
+            # before it) changed; rows that got narrower clear their tail
+            changed = (codes != self.codes) | (styles != self.styles) | (columns != self.columns)
+            shrunk = row_ends < self.row_ends
+            if grid.shape[1]:
+                changed[shrunk, -1] = True
+
+        lines = np.ascontiguousarray(codes).view(f"<U{max(grid.shape[1], 1)}").ravel()
+        cursor = None
+        for y in np.flatnonzero(changed.any(axis=1)):
+            xs = np.flatnonzero(changed[y])
+            breaks = np.flatnonzero(np.diff(xs) > MERGE_GAP)
+            starts = xs[np.r_[0, breaks + 1]]
+            ends = xs[np.r_[breaks, len(xs) - 1]] + 1
+            line = str(lines[y])
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                column = int(columns[y, start])
+                if cursor != (y, column):
+                    parts.append(f"\033[{y + 1};{column + 1}H")
+                    self.moves += 1
+                run = styles[y, start:end]
+                cuts = (np.flatnonzero(run[1:] != run[:-1]) + 1 + start).tolist()
+                for a, b in zip([start] + cuts, cuts + [end]):
+                    style = int(styles[y, a])
+                    if style != self.style:
+                        parts.append(self._sgr(style))
+                        self.style = style
+                    parts.append(line[a:b].ljust(b - a))
+                self.cells += end - start
+                cursor = (y, column + int(widths[y, start:end].sum()))
+            if shrunk[y]:
+                parts.append("\033[K")
+
+        data = "".join(parts).encode("utf-8")
+        start = time.perf_counter()
+        if data:
+            self.out.write(data)
+            self.out.flush()
+        self.write_seconds += time.perf_counter() - start
+        self.codes, self.styles, self.columns, self.row_ends = codes, styles, columns, row_ends
+        self.frames += 1
+        self.bytes += len(data)
+        if full:
+            self.full_frames += 1
+            self.full_bytes += len(data)
+        return len(data)
+
+    def _sgr(self, style):
+        escape = self.sgr.get(style)
+        if escape is None:
+            codes = ["0"]
+            if style & 1:
+                codes.append("7")
+            color = style // 2 - 1
+            if color >= 0:
+                r, g, b = asci_engine.color_palette()[color]
+                codes.append(f"38;2;{r};{g};{b}")
+            escape = self.sgr[style] = f"\033[{';'.join(codes)}m"
+        return escape
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "cells": self.cells,
+            "moves": self.moves,
+            "full_frames": self.full_frames,
+            "full_bytes": self.full_bytes,
+            "write_seconds": round(self.write_seconds, 3),
+        }
+
+
+class Player:
+    def __init__(self, screen, fps=None):
+        # fps: fixed rate; None plays every frame for its own duration
+        self.screen = screen
+        self.fps = fps
+        self.deadline = None
+
+        # Counters for tuning
+        self.shown = 0
+        self.dropped = 0
+        self.seconds = 0.0
+
+    def play(self, charset, frames):
+        start = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = start
+        late = None  # the last frame dropped, drawn if the stream ends on it
+        in_row = 0
+        try:
+            for grid, marks, colors, duration in frames:
+                self.deadline += 1 / self.fps if self.fps else duration / 1000
+                now = time.perf_counter()
+                if now > self.deadline and self.screen.codes is not None and in_row < MAX_DROPPED:
+                    late = (grid, marks, colors)
+                    self.dropped += 1
+                    in_row += 1
+                    continue
+                self.screen.draw(grid, charset, marks, colors)
+                self.shown += 1
+                late = None
+                if in_row:
+                    # Drawn late after a run of drops: restart the clock from
+                    # here instead of owing the terminal the lost time
+                    self.deadline = max(self.deadline, time.perf_counter())
+                    in_row = 0
+                wait = self.deadline - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            if late is not None:
+                self.screen.draw(late[0], charset, late[1], late[2])
+                self.shown += 1
+                self.dropped -= 1
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def stats(self):
+        return dict(self.screen.stats(), shown=self.shown, dropped=self.dropped,
+                    seconds=round(self.seconds, 3))
+
+    def report(self):
+        stats = self.stats()
+        frames = max(stats["frames"], 1)
+        fps = stats["shown"] / stats["seconds"] if stats["seconds"] else 0.0
+        full = stats["full_bytes"] / max(stats["full_frames"], 1)
+        return (f"{stats['shown']} frames shown, {stats['dropped']} dropped in {stats['seconds']:.1f}s "
+                f"({fps:.1f} fps), {stats['bytes'] / frames:,.0f} bytes/frame "
+                f"(full redraw {full:,.0f}), {stats['moves'] / frames:.1f} cursor moves/frame")
+
+
+def build_parser():
+    # asci_batch's flags plus the player's own; inputs are played in order
+    parser = asci_batch.build_parser()
+    parser.description = "Play ASCII frames in the terminal, redrawing only changed cells."
+    parser.set_defaults(cols=None)
+    parser.add_argument("--fps", type=float, help="frame rate (default: the frames' own durations)")
+    parser.add_argument("--loop", type=int, default=1, help="times to play the inputs, 0 = forever")
+    parser.add_argument("--chaos", action="store_true",
+                        help="play still inputs as the chaos animation (RANDOM FLIP sweep)")
+    parser.add_argument("--full-redraw", action="store_true",
+                        help="redraw every cell of every frame (for comparison)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.fps is not None and args.fps <= 0:
+        print("ERROR: --fps must be positive", file=sys.stderr)
+        return 2
+    try:
+        options = asci_batch.build_options(args)
+        sources = [open_source(path, options, args.chaos) for path in args.inputs]
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+
+    out = sys.stdout.buffer
+    player = Player(TerminalScreen(out, args.full_redraw), args.fps)
+    out.write(b"\033[?25l")  # hide the cursor while playing
+    try:
+        loop = 0
+        while args.loop == 0 or loop < args.loop:
+            for charset, frames in sources:
+                player.play(charset, frames())
+            loop += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rows = player.screen.codes.shape[0] if player.screen.codes is not None else 0
+        out.write(f"\033[0m\033[{rows + 1};1H\033[?25h".encode())
+        out.flush()
+        print(player.report(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
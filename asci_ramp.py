@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Glyph-coverage calibration: every glyph of a charset is rendered once with
+# the export font and its ink coverage measured, giving a ramp sorted by real
+# density and 256-entry luminance -> glyph tables. Calibrations are kept in a
+# small JSON cache on disk, one file per (charset, font, size). A charset the
+# font cannot draw completely keeps its hand-ordered (stock) ramp.
+from functools import lru_cache
+import hashlib
+import json
+import os
+import numpy as np
+import asci_engine
+import asci_raster
+
+CALIBRATION_SIZE = 24  # px; coverage ratios barely change with size
+CALIBRATION_VERSION = 2
+MISSING_PROBE = "\U0010fffd"  # private-use code point: renders as the font's missing-glyph box
+CACHE_DIR = os.environ.get("ASCI_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "asci"))
+
+# Counters for tuning
+stats = {"rendered": 0, "disk_hits": 0}
+
+
+class Ramp:
+    def __init__(self, charset, coverage, lut, inverted_lut, missing=""):
+        self.charset = charset
+        self.coverage = coverage  # ink share per glyph, 0..1, in charset order
+        self.lut = lut
+        self.inverted_lut = inverted_lut
+        self.missing = missing    # glyphs the font cannot draw; non-empty means stock tables
+
+    @property
+    def ramp(self):
+        # Charset sorted from densest to lightest glyph
+        if self.missing:
+            return self.charset
+        order = np.argsort(-self.coverage, kind="stable")
+        return "".join(self.charset[i] for i in order)
+
+    def lut_for(self, invert=False):
+        return self.inverted_lut if invert else self.lut
+
+
+def custom_charset(chars):
+    # User-typed charset: duplicates and line breaks dropped, order kept
+    chars = "".join(dict.fromkeys(ch for ch in chars if ch not in "\r\n\t"))
+    if not chars:
+        raise ValueError("charset is empty")
+    if len(chars) > asci_engine.MAX_CHARSET:
+        raise ValueError(f"charset has more than {asci_engine.MAX_CHARSET} characters")
+    return chars
+
+
+def _glyph_tiles(chars, font_path, size):
+    font = asci_raster.load_font(size, font_path)
+    char_width, line_height = asci_raster.cell_size(font)
+    atlas = asci_raster.get_atlas(size, char_width, line_height, chars, font_path)
+    codes = np.array([ord(ch) for ch in chars], dtype="<u4")
+    return atlas.tiles[atlas.lookup(codes)]
+
+
+def glyph_coverage(charset, font_path=asci_raster.DEFAULT_FONT, size=CALIBRATION_SIZE):
+    tiles = _glyph_tiles(charset, font_path, size)
+    stats["rendered"] += 1
+    return tiles.reshape(len(charset), -1).mean(axis=1) / 255
+
+
+def missing_glyphs(charset, font_path=asci_raster.DEFAULT_FONT, size=CALIBRATION_SIZE):
+    # Glyphs drawn as the missing-glyph box or not at all (whitespace aside):
+    # their coverage says nothing about the character. With no usable font
+    # (PIL's fallback font) this is every non-Latin glyph.
+    tiles = _glyph_tiles(charset + MISSING_PROBE, font_path, size)
+    box = tiles[-1]
+    return "".join(ch for ch, tile in zip(charset, tiles[:-1])
+                   if not ch.isspace() and (not tile.any() or np.array_equal(tile, box)))
+
+
+def stock_lut(length, invert=False):
+    # The hand-ordered ramp's table, as used without calibration
+    lut = asci_engine.build_lut(" " * length)
+    return (length - 1 - lut).astype(np.uint8) if invert else lut
+
+
+def coverage_lut(coverage, invert=False):
+    # Dark pixels get the densest glyph, as with the hand-ordered ramps;
+    # coverage is stretched to 0..1 so the lightest glyph still maps to white
+    low, high = coverage.min(), coverage.max()
+    if high - low < 1e-3:
+        # All glyphs look alike: keep the hand order
+        return stock_lut(len(coverage), invert)
+    levels = (coverage - low) / (high - low)
+    target = np.arange(256) / 255
+    if not invert:
+        target = 1 - target
+    return np.abs(target[:, None] - levels[None, :]).argmin(axis=1).astype(np.uint8)
+
+
+def _cache_path(charset, font_path, size, cache_dir):
+    # The font file's size and mtime are part of the key, so replacing it recalibrates
+    try:
+        info = os.stat(font_path)
+        font_id = [os.path.abspath(font_path), info.st_size, int(info.st_mtime)]
+    except OSError:
+        font_id = [font_path]
+    key = json.dumps([CALIBRATION_VERSION, charset, font_id, size], ensure_ascii=False)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"ramp-{digest}.json")
+
+
+def _read(path, charset):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["charset"] != charset:
+            return None
+        return Ramp(charset, np.array(data["coverage"]),
+                    np.array(data["lut"], dtype=np.uint8),
+                    np.array(data["inverted_lut"], dtype=np.uint8),
+                    data["missing"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write(path, ramp, font_path, size):
+    # Written to a temporary name and renamed, so readers never see half a file
+    data = {
+        "charset": ramp.charset,
+        "font": font_path,
+        "size": size,
+        "ramp": ramp.ramp,
+        "coverage": [round(float(c), 6) for c in ramp.coverage],
+        "lut": ramp.lut.tolist(),
+        "inverted_lut": ramp.inverted_lut.tolist(),
+        "missing": ramp.missing,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # read-only home: calibrate again next time
+
+
+@lru_cache(maxsize=32)
+def calibrate(charset, font_path=asci_raster.DEFAULT_FONT, size=CALIBRATION_SIZE, cache_dir=CACHE_DIR):
+    path = _cache_path(charset, font_path, size, cache_dir)
+    ramp = _read(path, charset)
+    if ramp is not None:
+        stats["disk_hits"] += 1
+        return ramp
+    coverage = glyph_coverage(charset, font_path, size)
+    missing = missing_glyphs(charset, font_path, size)
+    if missing:
+        # Measured and missing glyphs cannot be ranked against each other
+        ramp = Ramp(charset, coverage, stock_lut(len(charset)), stock_lut(len(charset), invert=True),
+                    missing)
+    else:
+        ramp = Ramp(charset, coverage, coverage_lut(coverage), coverage_lut(coverage, invert=True))
+    _write(path, ramp, font_path, size)
+    return ramp
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Glyph-atlas rasterizer: every glyph is drawn once per font/size/cell into a
+# cached atlas and whole character grids are assembled with NumPy tile gathers.
+from concurrent.futures import ThreadPoolExecutor
+from PIL import GifImagePlugin, Image, ImageDraw, ImageFont, ImageColor
+import numpy as np
+
+DEFAULT_FONT = "Courier.ttf"
+
+_font_cache = {}
+_atlas_cache = {}
+
+
+def load_font(size, path=DEFAULT_FONT):
+    # Fonts are opened once per (path, size) instead of on every export
+    key = (path, size)
+    font = _font_cache.get(key)
+    if font is None:
+        try:
+            font = ImageFont.truetype(path, size=size)
+        except IOError:
+            font = ImageFont.load_default()
+        _font_cache[key] = font
+    return font
+
+
+class GlyphAtlas:
+    def __init__(self, font, cell_width, cell_height):
+        self.font = font
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.index = {}  # code point -> tile number
+        self.tiles = np.zeros((0, cell_height, cell_width), dtype=np.uint8)
+
+    def add(self, chars):
+        missing = [ch for ch in dict.fromkeys(chars) if ord(ch) not in self.index]
+        if not missing:
+            return
+        tiles = np.zeros((len(missing), self.cell_height, self.cell_width), dtype=np.uint8)
+        for i, ch in enumerate(missing):
+            # Same origin as the old draw.text((x_pos, y_pos), ...) call, clipped to the cell
+            cell = Image.new("L", (self.cell_width, self.cell_height), 0)
+            ImageDraw.Draw(cell).text((0, 0), ch, font=self.font, fill=255)
+            tiles[i] = np.array(cell)
+            self.index[ord(ch)] = len(self.tiles) + i
+        self.tiles = np.concatenate([self.tiles, tiles])
+
+    def lookup(self, codes):
+        # Map an array of code points to tile numbers, rendering unseen glyphs first
+        unique, inverse = np.unique(codes, return_inverse=True)
+        self.add("".join(chr(c) for c in unique))
+        tile_ids = np.array([self.index[c] for c in unique.tolist()], dtype=np.intp)
+        return tile_ids[inverse].reshape(codes.shape)
+
+
+def get_atlas(size, cell_width, cell_height, charset="", font_path=DEFAULT_FONT):
+    key = (font_path, size, cell_width, cell_height)
+    atlas = _atlas_cache.get(key)
+    if atlas is None:
+        atlas = GlyphAtlas(load_font(size, font_path), cell_width, cell_height)
+        _atlas_cache[key] = atlas
+    # Pre-render the active charset so exports only gather tiles
+    atlas.add(charset + " ")
+    return atlas
+
+
+def lines_to_codes(lines):
+    # Character grid as a (rows, cols) array of code points, short rows padded with spaces
+    num_cols = max((len(line) for line in lines), default=0)
+    if num_cols == 0:
+        return np.zeros((len(lines), 0), dtype="<u4")
+    padded = np.array([line.ljust(num_cols) for line in lines], dtype=f"<U{num_cols}")
+    return padded.view("<u4").reshape(len(lines), num_cols)
+
+
+def color_lut(text_color, bg_color):
+    # 256 x 3 table blending background -> text color by glyph coverage
+    fg = np.array(ImageColor.getrgb(text_color)[:3], dtype=np.float32)
+    bg = np.array(ImageColor.getrgb(bg_color)[:3], dtype=np.float32)
+    alpha = np.arange(256, dtype=np.float32)[:, None] / 255
+    return np.rint(bg + (fg - bg) * alpha).astype(np.uint8)
+
+
+def cell_tiles(codes, atlas, marks=None):
+    # (rows, cols, cell height, cell width) glyph tiles; marks: optional
+    # (rows, cols) highlight flags, whose tiles are inverted
+    tile_ids = atlas.lookup(codes)  # may grow the atlas, so look up before indexing
+    tiles = atlas.tiles[tile_ids]
+    if marks is not None:
+        num_rows, num_cols = codes.shape
+        marked = marks[:num_rows, :num_cols]
+        tiles[marked] = 255 - tiles[marked]
+    return tiles
+
+
+def rasterize_coverage(codes, atlas, marks=None):
+    # Gather one tile per cell and interleave them into a single coverage bitmap
+    tiles = cell_tiles(codes, atlas, marks)
+    num_rows, num_cols = codes.shape
+    return tiles.transpose(0, 2, 1, 3).reshape(num_rows * atlas.cell_height,
+                                                num_cols * atlas.cell_width)
+
+
+def rasterize(lines, atlas, text_color, bg_color, colors=None, palette=None, marks=None):
+    # colors: optional (rows, cols) palette indices per cell (see
+    # asci_engine.cell_colors), cells with a negative index use text_color;
+    # marks: optional (rows, cols) highlight flags, drawn inverted. Lines must
+    # be plain text: highlights come in through marks, not ANSI escapes.
+    codes = lines_to_codes(lines)
+    coverage = rasterize_coverage(codes, atlas, marks)
+    num_rows, num_cols = codes.shape
+    if colors is None:
+        return Image.fromarray(color_lut(text_color, bg_color)[coverage])
+
+    fg = np.empty((num_rows, num_cols, 3), dtype=np.float32)
+    fg[:] = ImageColor.getrgb(text_color)[:3]
+    colors = colors[:num_rows, :num_cols]
+    rows, cols = np.nonzero(colors >= 0)
+    fg[rows, cols] = palette[colors[rows, cols]]
+    bg = np.array(ImageColor.getrgb(bg_color)[:3], dtype=np.float32)
+
+    # Same blend as color_lut, per cell: bg + (fg - bg) * alpha
+    alpha = coverage.reshape(num_rows, atlas.cell_height, num_cols, atlas.cell_width, 1)
+    out = (fg - bg)[:, None, :, None, :] * (alpha * np.float32(1 / 255))
+    out += bg
+    np.rint(out, out=out)
+    return Image.fromarray(out.astype(np.uint8).reshape(coverage.shape + (3,)))
+
+
+def cell_size(font):
+    # Character cell for a PIL font: advance width of "A" by ascent + descent
+    try:
+        ascent, descent = font.getmetrics()
+        char_width = font.getlength("A")
+    except AttributeError:
+        left, top, right, bottom = font.getbbox("Ag")
+        ascent, descent = bottom, 0
+        char_width = right / 2
+    return max(1, int(round(char_width))), max(1, ascent + descent)
+
+
+def palette_levels(text_color, bg_color, levels=16):
+    # Shared GIF palette: `levels` evenly spaced blends from background to text color
+    lut = color_lut(text_color, bg_color)
+    steps = np.linspace(0, 255, levels).round().astype(np.intp)
+    return lut[steps].ravel().tolist()
+
+
+def rasterize_palette(lines, atlas, text_color, bg_color, levels=16, marks=None):
+    # Palette ("P") frame whose indices are coverage levels, so every frame of
+    # an animation can share one palette without per-frame quantization
+    coverage = rasterize_coverage(lines_to_codes(lines), atlas, marks)
+    return coverage_to_palette(coverage, palette_levels(text_color, bg_color, levels), levels)
+
+
+def coverage_to_palette(coverage, palette, levels=16):
+    indices = ((coverage.astype(np.uint16) * (levels - 1) + 127) // 255).astype(np.uint8)
+    frame = Image.fromarray(indices)
+    frame.putpalette(palette)
+    return frame
+
+
+class GifWriter:
+    # Animated GIF written frame by frame: Pillow's save(append_images=...)
+    # holds every frame until the end. Frames are "P" images of one size that
+    # share the first frame's palette (e.g. from coverage_to_palette).
+    def __init__(self, path, loop=0):
+        self.file = open(path, "wb")
+        self.loop = loop
+        self.frames = 0
+
+    def add(self, frame, duration):
+        if self.frames == 0:
+            header, _ = GifImagePlugin.getheader(frame.copy(), info={"loop": self.loop})
+            self.file.write(b"".join(header))
+        self.file.write(b"".join(GifImagePlugin.getdata(frame, duration=duration)))
+        self.frames += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write(b";")  # GIF trailer
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def glitch_offsets(num_rows, num_cols, frame, rng, amplitude=5, jitter_chance=0.1, jitter=3):
+    # Horizontal pixel offset of every cell for one GIF frame: a sine sway per
+    # row plus occasional random jitter, same recipe as the old per-character loop
+    sway = (amplitude * np.sin(frame + np.arange(num_rows) / 2)).astype(np.intp)[:, None]
+    jolt = rng.integers(-jitter, jitter + 1, (num_rows, num_cols))
+    return sway + np.where(rng.random((num_rows, num_cols)) < jitter_chance, jolt, 0)
+
+
+def shift_tiles(tiles, offsets):
+    # Move every cell's glyph by its offset (clamped to one cell width) and
+    # composite the parts that spill into the neighbouring cells
+    num_rows, num_cols, cell_height, cell_width = tiles.shape
+    offsets = np.clip(offsets, -cell_width, cell_width)
+
+    # Each glyph on a 3-cell wide strip centred on its own cell
+    strip = np.arange(3 * cell_width) - cell_width - offsets[..., None]
+    inside = (strip >= 0) & (strip < cell_width)
+    cols = np.broadcast_to(np.clip(strip, 0, cell_width - 1)[:, :, None, :],
+                           (num_rows, num_cols, cell_height, 3 * cell_width))
+    spread = np.take_along_axis(tiles, cols, axis=3) * inside[:, :, None, :]
+
+    out = spread[..., cell_width:2 * cell_width].copy()
+    np.maximum(out[:, 1:], spread[:, :-1, :, 2 * cell_width:], out=out[:, 1:])
+    np.maximum(out[:, :-1], spread[:, 1:, :, :cell_width], out=out[:, :-1])
+    return out
+
+
+def render_glitch_gif(lines, atlas, path, text_color, bg_color, frames=10, duration=100,
+                      seed=None, workers=None, levels=16, marks=None):
+    # Animated glitch GIF: glyph tiles are gathered once, each frame only shifts
+    # them by its offset arrays. Frames render in parallel threads (NumPy releases
+    # the GIL) and all share one palette, so no per-frame quantization is needed.
+    # lines are plain text, highlighted cells come in as marks (see rasterize).
+    codes = lines_to_codes(lines)
+    tiles = cell_tiles(codes, atlas, marks)
+    num_rows, num_cols = codes.shape
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    palette = palette_levels(text_color, bg_color, levels)
+
+    def render(frame):
+        rng = np.random.default_rng([seed, frame])
+        shifted = shift_tiles(tiles, glitch_offsets(num_rows, num_cols, frame, rng))
+        coverage = shifted.transpose(0, 2, 1, 3).reshape(num_rows * atlas.cell_height,
+                                                          num_cols * atlas.cell_width)
+        return coverage_to_palette(coverage, palette, levels)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(render, range(frames)))
+    images[0].save(
+        path,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+        optimize=False
+    )
+    return len(images)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Background render scheduler: slider callbacks submit parameter snapshots,
+# one worker thread renders only the most recent one, and finished results are
+# handed back to the Tk main loop through root.after polling.
+import queue
+import threading
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class RenderScheduler:
+    def __init__(self, root, render, on_result, on_error=None, poll_ms=15):
+        # render(state, checkpoint) runs on the worker thread and should call
+        # checkpoint() between expensive steps so stale renders stop early
+        self.root = root
+        self.render = render
+        self.on_result = on_result
+        self.on_error = on_error
+        self.poll_ms = poll_ms
+
+        self.lock = threading.Condition()
+        self.pending = None     # (generation, state) waiting for the worker
+        self.generation = 0     # bumped on every submit; older renders are stale
+        self.closed = False
+        self.results = queue.Queue()
+
+        # Counters for tuning
+        self.submitted = 0
+        self.coalesced = 0      # snapshots replaced before the worker picked them up
+        self.cancelled = 0      # renders abandoned mid-way or finished too late
+        self.completed = 0      # results actually shown
+        self.failed = 0
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, state):
+        with self.lock:
+            self.generation += 1
+            self.submitted += 1
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = (self.generation, state)
+            self.lock.notify()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "dropped": self.coalesced + self.cancelled,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while self.pending is None and not self.closed:
+                    self.lock.wait()
+                if self.closed:
+                    return
+                generation, state = self.pending
+                self.pending = None
+
+            def checkpoint():
+                if generation != self.generation:
+                    raise RenderCancelled()
+
+            try:
+                result = self.render(state, checkpoint)
+            except RenderCancelled:
+                with self.lock:
+                    self.cancelled += 1
+                continue
+            except Exception as e:
+                self.results.put((generation, None, e))
+                continue
+            self.results.put((generation, result, None))
+
+    def _poll(self):
+        # Runs on the Tk thread, so results are applied where widgets may be touched
+        while True:
+            try:
+                generation, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if error is not None:
+                self.failed += 1
+                if self.on_error:
+                    self.on_error(error)
+            elif generation != self.generation:
+                with self.lock:
+                    self.cancelled += 1
+            else:
+                self.completed += 1
+                self.on_result(result)
+        if not self.closed:
+            self.root.after(self.poll_ms, self._poll)
+
+
+class FrameRing:
+    # Pre-rendered frames for a fixed cycle of animation levels (the RANDOM FLIP
+    # chaos animation), filled once on a background thread and stored compactly
+    # as whatever build() returns, e.g. index grids. The buffer is rebuilt only
+    # when the source object or the key describing it changes.
+    def __init__(self, levels):
+        self.levels = tuple(levels)
+        self.source = None
+        self.key = None
+        self.frames = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.built = 0
+
+    def prepare(self, source, key, build):
+        # Start filling the ring for (source, key) unless it already is
+        with self.lock:
+            if source is self.source and key == self.key:
+                return
+            self.source = source
+            self.key = key
+            self.frames = {}
+            self.generation += 1
+            generation = self.generation
+        threading.Thread(target=self._fill, args=(generation, build), daemon=True).start()
+
+    def invalidate(self):
+        with self.lock:
+            self.source = None
+            self.key = None
+            self.frames = {}
+            self.generation += 1
+
+    def get(self, level):
+        return self.frames.get(level)
+
+    def ready(self):
+        return len(self.frames) == len(self.levels)
+
+    def _fill(self, generation, build):
+        for level in self.levels:
+            if generation != self.generation:
+                return  # superseded by a newer image/charset/grid
+            frame = build(level)
+            with self.lock:
+                if generation != self.generation:
+                    return
+                self.frames[level] = frame
+                self.built += 1
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# Local HTTP conversion service: POST an image, get TXT, ANSI or PNG back.
+# Query parameters are the asci_batch flags without the leading dashes, so
+# both share one set of names, ranges and defaults:
+#   python asci_server.py --port 8765
+#   curl --data-binary @test.jpg "http://127.0.0.1:8765/convert?format=png&color&static=10" -o out.png
+#   curl http://127.0.0.1:8765/stats
+# The event loop only parses requests and shuffles bytes; decoding and
+# conversion run in a process pool. Requests beyond the pool's queue limit get
+# 429, recent results are kept in an in-memory LRU.
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from PIL import Image, UnidentifiedImageError
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import asci_batch
+import asci_cache
+import asci_engine
+
+FORMATS = {
+    "txt": "text/plain; charset=utf-8",
+    "ansi": "text/plain; charset=utf-8",
+    "png": "image/png",
+}
+MAX_BODY = 64 * 1024 * 1024
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+HEADER_TIMEOUT = 10  # seconds to send the request head
+BODY_TIMEOUT = 60    # seconds to send the image; a trickled upload holds a queue slot
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+def request_argv(query):
+    # Query string -> asci_batch command line; bare or truthy names switch flags on
+    defaults = asci_batch.build_parser()
+    argv = ["upload"]
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name == "format":
+            continue
+        flag = "--" + name.replace("_", "-")
+        if defaults.get_default(name.replace("-", "_")) is False:
+            if value.lower() in ("", "1", "true", "yes", "on"):
+                argv.append(flag)
+        else:
+            argv.append(f"{flag}={value}")
+    return argv
+
+
+def upload_options(argv):
+    parser = asci_batch.build_parser()
+
+    def error(message):
+        raise RequestError(400, message)
+    parser.error = error
+    try:
+        return asci_batch.build_options(parser.parse_args(argv))
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    except SystemExit:
+        raise RequestError(400, "unsupported parameter")  # --help, --version
+
+
+def convert_upload(data, argv, output_format):
+    # Runs in a worker process: same options and conversion as asci_batch
+    options = upload_options(argv)
+    try:
+        img = Image.open(io.BytesIO(data))
+        num_cols, num_rows = asci_batch.grid_size(img.size, options["cols"], options["rows"])
+        cells = asci_batch.convert_image(img, num_cols, num_rows, options)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise RequestError(400, "cannot read image" if isinstance(e, UnidentifiedImageError) else str(e))
+    except ValueError as e:
+        raise RequestError(400, str(e))  # parameters the image cannot be converted with
+
+    if output_format == "png":
+        out = io.BytesIO()
+        asci_batch.rasterize_cells(cells, options).save(out, "PNG", compress_level=1)
+        return out.getvalue()
+    grid, marks, colors = cells
+    ascii_chars = options["effects"]["ascii_chars"]
+    if output_format == "ansi" and colors is not None:
+        lines = asci_engine.grid_to_ansi(grid, ascii_chars, colors, marks)
+    elif output_format == "ansi":
+        lines = asci_engine.grid_to_lines(grid, ascii_chars, marks)
+    else:
+        lines = asci_engine.grid_to_lines(grid, ascii_chars)
+    return "\n".join(lines).encode("utf-8")
+
+
+class ConversionServer:
+    def __init__(self, workers=None, max_pending=None, cache_bytes=RESULT_CACHE_BYTES,
+                 max_body=MAX_BODY, body_timeout=BODY_TIMEOUT):
+        workers = workers or os.cpu_count() or 1
+        # Workers are started on demand while connections are open; forked ones
+        # would inherit those sockets and keep them open after we close them
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        self.max_pending = max_pending or 4 * workers
+        self.cache_bytes = cache_bytes
+        self.max_body = max_body
+        self.body_timeout = body_timeout
+        self.pending = 0  # accepted requests (body being read or converting) not finished yet
+        self.results = OrderedDict()  # key -> (content type, body), most recent last
+        self.results_size = 0
+
+        # Counters for tuning
+        self.requests = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.body_timeouts = 0  # uploads dropped for sending too slowly
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.convert_seconds = 0.0
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "body_timeouts": self.body_timeouts,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_entries": len(self.results),
+            "cache_bytes": self.results_size,
+            "convert_seconds": round(self.convert_seconds, 3),
+        }
+
+    async def handle(self, reader, writer):
+        self.requests += 1
+        headers = {}
+        try:
+            status, content_type, body, headers = await self.respond(reader, writer)
+        except RequestError as e:
+            status, content_type, body = e.status, "text/plain; charset=utf-8", (e.message + "\n").encode()
+            if status == 429:
+                headers = {"Retry-After": "1"}
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            self.failed += 1
+            status, content_type, body = 500, "text/plain; charset=utf-8", f"{e}\n".encode()
+
+        head = [f"HTTP/1.1 {status} {REASONS[status]}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def respond(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+        except (asyncio.LimitOverrunError, ValueError):
+            raise RequestError(400, "request head too large")
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ")
+        except ValueError:
+            raise RequestError(400, "malformed request line")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+
+        if url.path == "/stats":
+            return 200, "application/json", json.dumps(self.stats()).encode(), {}
+        if url.path != "/convert":
+            raise RequestError(404, "try POST /convert or GET /stats")
+        if method != "POST":
+            raise RequestError(405, "POST the image bytes to /convert")
+        output_format = dict(parse_qsl(url.query)).get("format", "txt")
+        if output_format not in FORMATS:
+            raise RequestError(400, f"format must be one of {', '.join(FORMATS)}")
+        try:
+            length = int(headers.get("content-length", ""))
+        except ValueError:
+            raise RequestError(400, "Content-Length required")
+        if length > self.max_body:
+            raise RequestError(413, f"images up to {self.max_body // (1024 * 1024)} MB")
+
+        # Backpressure before the body is read: a full queue costs the client
+        # nothing. The slot is taken here, so uploads still being read count
+        # against the limit too.
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise RequestError(429, "too many conversions queued, retry later")
+        self.pending += 1
+        try:
+            return await self.convert(reader, writer, url.query, headers, length, output_format)
+        finally:
+            self.pending -= 1
+
+    async def convert(self, reader, writer, query, headers, length, output_format):
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        try:
+            data = await asyncio.wait_for(reader.readexactly(length), self.body_timeout)
+        except asyncio.TimeoutError:
+            self.body_timeouts += 1
+            raise
+
+        argv = request_argv(query)
+        key = asci_cache.render_key(hashlib.sha1(data).hexdigest(), [output_format, argv])
+        cached = self.results.get(key)
+        if cached is not None:
+            self.results.move_to_end(key)
+            self.cache_hits += 1
+            self.completed += 1
+            return 200, cached[0], cached[1], {"X-Cache": "hit"}
+        self.cache_misses += 1
+
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(self.pool, convert_upload, data, argv, output_format)
+        finally:
+            self.convert_seconds += time.perf_counter() - start
+        self.remember(key, FORMATS[output_format], body)
+        self.completed += 1
+        return 200, FORMATS[output_format], body, {"X-Cache": "miss"}
+
+    def remember(self, key, content_type, body):
+        if len(body) > self.cache_bytes:
+            return
+        self.results[key] = (content_type, body)
+        self.results_size += len(body)
+        while self.results_size > self.cache_bytes:
+            _, (_, old) = self.results.popitem(last=False)
+            self.results_size -= len(old)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Listening on http://{host}:{port}/convert", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Local HTTP ASCII conversion service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="conversion processes")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="conversions queued or running before 429 (default 4 per worker)")
+    parser.add_argument("--cache-size", type=float, default=RESULT_CACHE_BYTES / 1024 / 1024,
+                        help="in-memory result cache in MB")
+    parser.add_argument("--max-body", type=float, default=MAX_BODY / 1024 / 1024,
+                        help="largest accepted upload in MB")
+    parser.add_argument("--body-timeout", type=float, default=BODY_TIMEOUT,
+                        help="seconds a client gets to send the image")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = ConversionServer(max(1, args.workers), args.max_pending,
+                              int(args.cache_size * 1024 * 1024), int(args.max_body * 1024 * 1024),
+                              args.body_timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown(cancel_futures=True)
+        print(json.dumps(server.stats()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Structure-aware glyph matching: each cell is sampled at sub-cell resolution
+# and gets the glyph whose rendered bitmap is closest, so edges and lines pick
+# matching strokes instead of only matching the cell's mean brightness.
+from functools import lru_cache
+from PIL import Image
+import numpy as np
+import asci_ramp
+import asci_raster
+
+SUBCELL = (4, 8)  # samples per cell along x and y
+SHAPE_FONT_SIZE = 24
+TONE_WEIGHT = 16  # how much more a cell's mean ink counts than its shape; plain
+                  # L2 (1) favours low-contrast glyphs everywhere in flat areas
+
+
+class GlyphFeatures:
+    # Glyph bitmaps box-filtered down to SUBCELL samples, one row per glyph of
+    # the charset, plus a weighted mean-ink column and the squared norms used
+    # by the distance matmul. Glyphs the font cannot draw all share its
+    # missing-glyph box; callers should map without shapes when `missing` is set.
+    def __init__(self, charset, font_path=asci_raster.DEFAULT_FONT, size=SHAPE_FONT_SIZE,
+                 subcell=SUBCELL, tone_weight=TONE_WEIGHT):
+        self.charset = charset
+        self.subcell = subcell
+        self.missing = asci_ramp.missing_glyphs(charset, font_path, size)
+        font = asci_raster.load_font(size, font_path)
+        char_width, line_height = asci_raster.cell_size(font)
+        atlas = asci_raster.get_atlas(size, char_width, line_height, charset, font_path)
+        codes = np.array([ord(ch) for ch in charset], dtype="<u4")
+        samples = subcell[0] * subcell[1]
+        features = np.empty((len(charset), samples + 1), dtype=np.float32)
+        for i, tile in enumerate(atlas.tiles[atlas.lookup(codes)]):
+            small = Image.fromarray(tile).resize(subcell, Image.Resampling.BOX)
+            features[i, :samples] = np.asarray(small, dtype=np.float32).ravel() / 255
+
+        # Extra column: with it the squared distance gains tone_weight - 1 extra
+        # copies of the (mean ink difference)^2 term
+        coverage = features[:, :samples].mean(axis=1)
+        self.tone_scale = np.float32(np.sqrt((tone_weight - 1) * samples) / samples)
+        features[:, samples] = coverage * samples * self.tone_scale
+        self.features = features
+        self.norms = (features ** 2).sum(axis=1)
+
+        # Cell ink is stretched onto the glyphs' own coverage range, so flat
+        # areas still land on the glyph with the right overall density
+        self.low = float(coverage.min())
+        self.high = float(coverage.max())
+
+    def match(self, gray, invert=False):
+        # gray: (rows * sub_h, cols * sub_w) uint8 samples -> (rows, cols) grid
+        # of charset indices. argmin |x - g|^2 = argmin |g|^2 - 2 x.g, one matmul
+        # over all cells.
+        sub_w, sub_h = self.subcell
+        num_rows, num_cols = gray.shape[0] // sub_h, gray.shape[1] // sub_w
+        samples = sub_w * sub_h
+        cells = gray.reshape(num_rows, sub_h, num_cols, sub_w).transpose(0, 2, 1, 3)
+        ink = np.empty((num_rows * num_cols, samples + 1), dtype=np.float32)
+        ink[:, :samples] = cells.reshape(num_rows * num_cols, samples)
+        view = ink[:, :samples]
+        if invert:
+            view *= (self.high - self.low) / 255
+        else:
+            view *= -(self.high - self.low) / 255
+            view += self.high - self.low
+        view += self.low
+        ink[:, samples] = view.sum(axis=1) * self.tone_scale
+        scores = ink @ self.features.T
+        scores *= -2
+        scores += self.norms
+        return scores.argmin(axis=1).astype(np.uint8).reshape(num_rows, num_cols)
+
+    def map(self, img, num_cols, num_rows, invert=False, pyramid=None):
+        # Drop-in for asci_engine.map_indices
+        size = (num_cols * self.subcell[0], num_rows * self.subcell[1])
+        if pyramid is not None:
+            img = pyramid.level_for(size)
+        return self.match(np.asarray(img.convert("L").resize(size)), invert)
+
+
+@lru_cache(maxsize=16)
+def glyph_features(charset, font_path=asci_raster.DEFAULT_FONT, size=SHAPE_FONT_SIZE):
+    return GlyphFeatures(charset, font_path, size)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Process pool that moves decoded images and result grids through shared
+# memory: the parent copies each image into a block once, workers attach to it
+# by name, run the effect chain and ASCII mapping and write the grid into a
+# second block. Only block names and shape/dtype metadata are pickled. The
+# parent creates and unlinks every block, so a crashed worker cannot leak one.
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image
+import multiprocessing
+import os
+import pickle
+import threading
+import numpy as np
+import asci_engine
+
+# Keyword arguments of submit() that belong to the effect chain and mapping;
+# everything else a convert() caller passes is a glitch effect
+MAP_PARAMS = ("ascii_chars", "invert", "lut", "glyph_features", "brightness", "contrast",
+              "exposure", "distortion", "noise", "black_and_white", "float32", "noise_frame",
+              "pixel_scale")
+
+# Start method for pools created by a parent that runs threads (the GUI):
+# forkserver where the platform has it, spawn otherwise (Windows)
+THREAD_SAFE_START = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class SharedArray:
+    # NumPy array over a shared memory block; `handle` is what crosses processes
+    def __init__(self, shape, dtype, name=None):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def attach(cls, handle):
+        name, shape, dtype = handle
+        return cls(shape, dtype, name)
+
+    @property
+    def handle(self):
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def close(self):
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a view is still referenced (e.g. by a traceback); freed with it
+
+    def unlink(self):
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _map_shared(image_handle, grid_handle, num_cols, num_rows, ascii_chars=asci_engine.ASCII_BASIC,
+                invert=False, lut=None, glyph_features=None, **effects):
+    # Runs in a worker process
+    pixels = SharedArray.attach(image_handle)
+    grid = SharedArray.attach(grid_handle)
+    try:
+        img = Image.fromarray(pixels.array, "RGB")
+        img = asci_engine.process_image(img, **effects)
+        grid.array[:] = asci_engine.map_grid(img, num_cols, num_rows, ascii_chars, invert, lut=lut,
+                                             glyph_features=glyph_features)
+        del img
+    finally:
+        pixels.close()
+        grid.close()
+
+
+class SharedTask:
+    def __init__(self, pool, future, blocks):
+        self.pool = pool
+        self.future = future
+        self.blocks = blocks  # (image, grid)
+
+    def result(self):
+        # The (rows, cols) index grid; the task's blocks are released either way
+        try:
+            self.future.result()
+            return self.blocks[1].array.copy()
+        finally:
+            self.pool.release(self.blocks)
+
+
+class SharedMemoryPool:
+    def __init__(self, workers=None, start_method=None):
+        # start_method THREAD_SAFE_START for parents that run threads (the GUI)
+        self.workers = workers or os.cpu_count() or 1
+        context = multiprocessing.get_context(start_method) if start_method else None
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self.blocks = set()  # created and not yet unlinked
+        self.lock = threading.Lock()
+
+        # Counters for tuning
+        self.tasks = 0
+        self.bytes_shared = 0    # image and grid bytes that went through blocks
+        self.bytes_pickled = 0   # task arguments that were pickled to the workers
+
+    def submit(self, img, num_cols, num_rows, **params):
+        # img: PIL image; params: see MAP_PARAMS. Returns a SharedTask.
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        image = self._create((img.height, img.width, 3), np.uint8)
+        grid = self._create((num_rows, num_cols), np.uint8)
+        try:
+            np.copyto(image.array, np.asarray(img))
+            args = (image.handle, grid.handle, num_cols, num_rows)
+            self.tasks += 1
+            self.bytes_shared += image.nbytes + grid.nbytes
+            self.bytes_pickled += len(pickle.dumps((args, params), pickle.HIGHEST_PROTOCOL))
+            future = self.executor.submit(_map_shared, *args, **params)
+        except BaseException:
+            self.release((image, grid))
+            raise
+        return SharedTask(self, future, (image, grid))
+
+    def release(self, blocks):
+        for block in blocks:
+            with self.lock:
+                if block not in self.blocks:
+                    continue
+                self.blocks.discard(block)
+            block.unlink()
+
+    def close(self):
+        # Cancelled or abandoned tasks still own blocks; unlink whatever is left
+        self.executor.shutdown(cancel_futures=True)
+        with self.lock:
+            blocks = list(self.blocks)
+        self.release(blocks)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "tasks": self.tasks,
+            "bytes_shared": self.bytes_shared,
+            "bytes_pickled": self.bytes_pickled,
+            "live_blocks": len(self.blocks),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _create(self, shape, dtype):
+        block = SharedArray(shape, dtype)
+        with self.lock:
+            self.blocks.add(block)
+        return block
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Display layer for the DIGITAL OUTPUT text widget: remembers the rows it last
+# showed and only rewrites the line ranges that changed, so Tk does not have to
+# re-layout tens of thousands of characters on every slider tick. In color mode
+# each changed row is also tagged with one Tk tag per run of equal color; tags
+# are per palette entry and shared by all renders, so Tk never sees more than
+# the palette size in tag definitions.
+import tkinter as tk
+import numpy as np
+
+FULL_REPLACE_RATIO = 0.5  # above this share of changed rows a full replace is cheaper
+
+
+class TextGridView:
+    def __init__(self, text, full_replace_ratio=FULL_REPLACE_RATIO, palette=None):
+        self.text = text
+        self.full_replace_ratio = full_replace_ratio
+        self.palette = palette  # (n, 3) uint8 colors the color indices refer to
+        self.rows = []
+        self.styles = []  # per row: color and highlight bytes it was tagged with
+        self.color_tags = {}
+        self.text.tag_configure("highlight")
+
+        # Counters for tuning
+        self.frames = 0
+        self.rows_rewritten = 0         # total over all frames
+        self.last_rows_rewritten = 0    # in the most recent frame
+        self.full_replaces = 0
+        self.last_tag_ranges = 0
+
+    def update(self, rows, colors=None, marks=None):
+        # colors: optional (rows, cols) palette indices, negative = widget color;
+        # marks: optional (rows, cols) highlight flags from apply_glitch_effects
+        rows = list(rows)
+        styles = self._styles(rows, colors, marks)
+        self.frames += 1
+
+        # Row count changes (or edits typed into the widget) need a full replace
+        shown_rows = int(self.text.index("end-1c").split(".")[0])
+        if len(rows) != len(self.rows) or shown_rows != len(self.rows):
+            self._replace_all(rows, styles, colors, marks)
+            return
+
+        changed = [i for i, (old, new, old_style, new_style)
+                   in enumerate(zip(self.rows, rows, self.styles, styles))
+                   if old != new or old_style != new_style]
+        if len(changed) > self.full_replace_ratio * len(rows):
+            self._replace_all(rows, styles, colors, marks)
+            return
+
+        # Rewritten text comes back untagged, so only changed rows need tags
+        for start, end in self._ranges(changed):
+            self.text.delete(f"{start + 1}.0", f"{end}.end")
+            self.text.insert(f"{start + 1}.0", "\n".join(rows[start:end]))
+        self.rows = rows
+        self.styles = styles
+        self._tag_rows(changed, colors, marks)
+        self.last_rows_rewritten = len(changed)
+        self.rows_rewritten += len(changed)
+
+    def set_highlight_colors(self, text_color, bg_color):
+        # Highlighted cells are drawn inverted, like the terminal's reverse video
+        self.text.tag_configure("highlight", foreground=bg_color, background=text_color)
+
+    def clear(self):
+        self.text.delete(1.0, tk.END)
+        self.rows = []
+        self.styles = []
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "rows_rewritten": self.rows_rewritten,
+            "last_rows_rewritten": self.last_rows_rewritten,
+            "full_replaces": self.full_replaces,
+            "color_tags": len(self.color_tags),
+            "last_tag_ranges": self.last_tag_ranges,
+        }
+
+    def _replace_all(self, rows, styles, colors, marks):
+        self.text.delete(1.0, tk.END)
+        self.text.insert(tk.END, "\n".join(rows))
+        self.rows = rows
+        self.styles = styles
+        self._tag_rows(range(len(rows)), colors, marks)
+        self.full_replaces += 1
+        self.last_rows_rewritten = len(rows)
+        self.rows_rewritten += len(rows)
+
+    @staticmethod
+    def _styles(rows, colors, marks):
+        # What a row is tagged with, comparable between frames
+        styles = []
+        for y, row in enumerate(rows):
+            style = b""
+            if colors is not None:
+                style += colors[y, :len(row)].tobytes()
+            if marks is not None:
+                style += marks[y, :len(row)].tobytes()
+            styles.append(style)
+        return styles
+
+    def _tag(self, color):
+        tag = self.color_tags.get(color)
+        if tag is None:
+            tag = f"c{color}"
+            r, g, b = self.palette[color]
+            self.text.tag_configure(tag, foreground=f"#{r:02x}{g:02x}{b:02x}")
+            self.text.tag_raise("highlight", tag)
+            self.color_tags[color] = tag
+        return tag
+
+    def _tag_rows(self, row_numbers, colors, marks):
+        # Run-length merge each row, then one tag_add per tag for all its runs
+        if colors is None and marks is None:
+            self.last_tag_ranges = 0
+            return
+        ranges = {}
+        for y in row_numbers:
+            width = len(self.rows[y])
+            if colors is not None:
+                for start, end, color in self._runs(colors[y, :width]):
+                    if color >= 0:
+                        ranges.setdefault(self._tag(int(color)), []).extend(
+                            (f"{y + 1}.{start}", f"{y + 1}.{end}"))
+            if marks is not None:
+                for start, end, mark in self._runs(marks[y, :width]):
+                    if mark:
+                        ranges.setdefault("highlight", []).extend(
+                            (f"{y + 1}.{start}", f"{y + 1}.{end}"))
+        for tag, indices in ranges.items():
+            self.text.tag_add(tag, *indices)
+        self.last_tag_ranges = sum(len(indices) for indices in ranges.values()) // 2
+
+    @staticmethod
+    def _runs(values):
+        # (start, end, value) for each run of equal values
+        if not len(values):
+            return []
+        starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        ends = np.r_[starts[1:], len(values)]
+        return zip(starts.tolist(), ends.tolist(), values[starts].tolist())
+
+    @staticmethod
+    def _ranges(changed):
+        # Collapse sorted row numbers into (start, end) runs of consecutive rows
+        start = prev = None
+        for i in changed:
+            if start is None:
+                start = prev = i
+            elif i == prev + 1:
+                prev = i
+            else:
+                yield start, prev + 1
+                start = prev = i
+        if start is not None:
+            yield start, prev + 1